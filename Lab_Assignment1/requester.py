@@ -1,17 +1,40 @@
 import argparse
+import math
 import socket
-from collections import defaultdict
-from typing import DefaultDict, Tuple, List
-import struct
+from collections import defaultdict, deque
+from typing import Callable, DefaultDict, Dict, Optional, Tuple, List
 from typing import Literal
-from datetime import datetime
 import time
 import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)) # Make the shared modules importable
+from common import codec
+from common.checkpoint import SUFFIX, Checkpoint, copy_ranges
+from common.pktlog import PacketLog, add_log_arguments, format_time
+from common.reassembly import OutputFile, Reassembler
+
+FIRST_SEQ = 1 # Sequence number every sender is asked to start at, so a byte's offset is its sequence number - FIRST_SEQ
+REST_OF_FILE = 1 << 62 # Range length that reaches to the end of any file, the sender cuts it to the file
+PARALLEL_SUFFIX = ".parts" + SUFFIX # Journal of the spools of -a, apart from the one of the output so the modes never mix
+
+HEDGE_PERCENTILE = 95 # A part that is silent for longer than this percentile of the gaps seen so far is hedged
+HEDGE_FACTOR = 2 # ... times this, so ordinary jitter does not cause hedges
+MIN_HEDGE_DELAY = 0.05 # Seconds, never hedge sooner than this
+INITIAL_HEDGE_DELAY = 0.5 # Seconds, used until some gaps have been measured
+LATENCY_SAMPLES = 256 # Gaps kept to compute the percentile
+
+TARGET_REQUEST_TIME = 0.2 # Seconds of work a sender is given per range once its throughput is known
+MAX_UNITS_PER_REQUEST = 64 # Most work units handed out in one range
+THROUGHPUT_WEIGHT = 0.5 # Weight of the newest measurement in the throughput estimate of a sender
+
+Replica = Tuple[str, int] # (address, port) of one sender holding a part
 
 
 class Requester:
     # Initialize function
-    def __init__(self, port: int, file_option: str) -> None:
+    def __init__(self, port: int, file_option: str, parallel: bool = False, pktlog: PacketLog = None, hedge_percentile: int = HEDGE_PERCENTILE,
+                 stripe: int = 0) -> None:
         self.receive_port = port # The receiving port
         self.UDP_IP = socket.gethostbyname(socket.gethostname())
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # Socket Creation
@@ -19,110 +42,338 @@ class Requester:
         self.file_option = file_option # Set the file option
         self.tracker_info = self.read_tracker() # Tracks the info
         self.sender_ports = [] # All the ports
+        self.buffer = bytearray(65536) # Every packet is received into this one buffer
+        self.view = memoryview(self.buffer)
+        self.parallel = parallel # Fetch all the parts at the same time instead of one after another
+        self.stripe = stripe # Size of the byte ranges one shared file is striped in across the senders, 0 for whole parts
+        self.pktlog = pktlog or PacketLog(formatter=self.format_info) # Per-packet log, written out off the receive path
+        self.gaps = LatencyTracker(hedge_percentile) # Silences seen between packets, decide when a part is hedged
+        self.replica_latency: Dict[Replica, float] = {} # Time each sender took to answer its last request
+        self.routes: Dict[Replica, "Download"] = {} # Part each requested sender is sending
+        self.header = codec.pack_inner(codec.REQUEST, FIRST_SEQ, 0) # Request header, asking the senders to number the bytes from FIRST_SEQ
 
-        self.send_request() # Calls send_request
+        # Check whether the parts are fetched at the same time
+        try:
+            if self.stripe > 0:
+                self.fetch_striped() # Calls fetch_striped
+            elif self.parallel:
+                self.fetch_parallel() # Calls fetch_parallel
+            else:
+                self.send_request() # Calls send_request
+        finally:
+            self.pktlog.close() # Write out what is left of the per-packet log
 
-    # Function is to read tracker.txt
-    def read_tracker(self) -> DefaultDict[str, List[Tuple[int, str, int]]]:
-        info = defaultdict(list) # Info as a dictionary
+    # Function is to read tracker.txt. A part ID may appear on several lines, or a line may
+    # list several "hostname port" pairs, every one of them is a replica holding the same part.
+    def read_tracker(self) -> DefaultDict[str, List[Tuple[int, List[Replica]]]]:
+        replicas = defaultdict(dict) # {file_option: {ID: [replica, ...]}}
 
         # Open the tracker file
         with open("tracker.txt", "r") as f:
             # For loop
             for line in f:
                 # Read each line
-                line = line.replace("\n", "").split(" ")
-                # Put the info for each line in the dictionary
-                info[line[0]].append((int(line[1]), socket.gethostbyname(line[2]), int(line[3])))
+                line = line.split()
+                if not line:
+                    continue
+                part = replicas[line[0]].setdefault(int(line[1]), [])
+                # Put every replica on the line in the dictionary, once
+                for i in range(2, len(line) - 1, 2):
+                    replica = (socket.gethostbyname(line[i]), int(line[i + 1]))
+                    if replica not in part:
+                        part.append(replica)
 
-        # format: {file_option: [(ID, hostname, port), (ID, hostname, port)]} sorted by ID
-        for s in info.values():
-            s.sort(key=lambda x: x[0])
+        # format: {file_option: [(ID, [(address, port), ...]), ...]} sorted by ID, replicas in tracker order
+        info = defaultdict(list)
+        for file_option, parts in replicas.items():
+            info[file_option] = sorted(parts.items())
 
         return info
 
     # Function to send datagrams to UDP socket
     def send_request(self) -> None:
-        # Create header
-        header = struct.pack("!cII", "R".encode(), 0, 0)
-
-        # Loop through all the information in tracker.txt
-        for dest in self.tracker_info[self.file_option]:
-            # Send the datagrams to the destination with sender's address and port
-            self.sock.sendto(header + self.file_option.encode(), (dest[1], dest[2]))
-            self.receive_file(dest[1], dest[2]) # Calls recieve file with address and port 
-
-    # This function opens the file and write the packets into a text file and logs all the info
-    def receive_file(self, sender_address, sender_port) -> None:
-        start_time = time.time() # Start the time
-        num_data_packets = 0 # Set variable for number of data packets
-        total_byte = 0 # Set variable for total bytes
-        packet, req_addr = self.sock.recvfrom(8192) # Get the packet and requester address from socket
-        
-        # Open the file
-        with open(self.file_option, "a") as file:
-            self.sender_ports.append(req_addr[0]) # Get the address of client socket or requester address
-            header = packet[:9] # Get the header
-            payload = packet[9:] # Get the payload
-            headers = struct.unpack("!cII", header) # Unpack the header
-            # Get the type of request, sequence, length, and the contents of the file
-            request_type, sequence, length, file_content = (headers[0].decode(), socket.htonl(headers[1]), headers[2],payload)
-            path = './' + self.file_option # Get path of the file
-            file_size = os.stat(path).st_size # Get the size of the file
-
-            # Check if the file exissts and if there is content inside
-            if(os.path.isfile(path) and file_size != 0):
-                file.write("\n") # Make a new line
-
-            # Check if the type is D or not
-            if request_type != "D":
-                print(f"[Error] first packet recived should be a request with request type 'D', but got {request_type} instead.")
-            
-            # While the type isn't the end packet
-            while request_type != "E":
-                file.write(file_content.decode()) # Write the contents inside the file
-                num_data_packets += 1 # Increment the number of data packets
-                total_byte += length # Increase the total bytes with the length
-                packet, req_addr = self.sock.recvfrom(8192) # Get the packet and requester address from socket
-                self.sender_ports.append(req_addr[0]) # Get the address
-                header = packet[:9] # Get header
-                payload = packet[9:] # Get payload
-                headers = struct.unpack("!cII", header) # Unpack the header
-                if(headers[0].decode() == "E"):
-                    self.log_info(sender_address, sender_port, "D", sequence, length + 1, file_content) # Log the info of the DATA packet
-                else:
-                    self.log_info(sender_address, sender_port, "D", sequence, length, file_content) # Log the info of the DATA packet
-                # Get the request type, sequence, length, and contents of file
-                request_type, sequence, length, file_content = (headers[0].decode(), socket.htonl(headers[1]), headers[2], payload,)
-        
-        self.log_info(sender_address, sender_port, "E", sequence, len(payload), b"") # Logo the info of the END packet
-        duration = int((time.time() - start_time) * 1000) # Get the time it took to complete all the packets
-        avg_time_per_packet = round(num_data_packets / (duration / 1000)) # Get the average time for each packet
-        
-        self.log_Summary(sender_address, sender_port, num_data_packets, total_byte, duration, avg_time_per_packet) # Log the summary
-
-    # Function that logs the info
+        # The output is opened once, every part is placed after the ones before it
+        with OutputFile(self.file_option) as output:
+            checkpoint = self.open_checkpoint(output)
+            # Loop through all the parts in tracker.txt
+            for part_id, replicas in self.tracker_info[self.file_option]:
+                self.receive_file(part_id, replicas, output, checkpoint) # Calls recieve file with the replicas of the part
+            checkpoint.close(remove=checkpoint.all_complete()) # Kept only while some part is still missing bytes
+
+    # Open the checkpoint next to the output. If an earlier run was interrupted, whatever
+    # it wrote past the ranges it recorded is dropped, it is fetched again.
+    def open_checkpoint(self, output: OutputFile) -> Checkpoint:
+        checkpoint = Checkpoint(self.file_option + SUFFIX, output.sync)
+        if checkpoint.resuming():
+            output.size = checkpoint.logical_size()
+            print(f"[Info] resuming {self.file_option} from {self.file_option + SUFFIX}")
+        return checkpoint
+
+    # Request every part at once and receive them all on the one socket
+    def fetch_parallel(self) -> None:
+        # The part sizes are not known yet, so every part is reassembled in its own spool file next
+        # to the output. The journal records the ranges of every spool, an interrupted run only asks
+        # for what they are missing. Every part starts out at the size the output had before, where
+        # the parts are appended once all of them are complete.
+        spools: Dict[int, OutputFile] = {}
+        def sync() -> None:
+            for spool in spools.values():
+                spool.sync()
+        checkpoint = Checkpoint(self.file_option + PARALLEL_SUFFIX, sync)
+        if checkpoint.resuming():
+            print(f"[Info] resuming {self.file_option} from {checkpoint.path}")
+        base = os.path.getsize(self.file_option) if os.path.exists(self.file_option) else 0
+
+        downloads = []
+        for part_id, replicas in self.tracker_info[self.file_option]:
+            part = checkpoint.parts.get(part_id)
+            if part is None:
+                part = checkpoint.start_part(part_id, base)
+                spools[part_id] = OutputFile(f"{self.file_option}.part{part_id}", truncate=True)
+                download = Download(part_id, self.order_replicas(replicas), spools[part_id], 0)
+            else:
+                # whatever the spool holds past the ranges recorded is dropped, it is fetched again
+                spools[part_id] = OutputFile(f"{self.file_option}.part{part_id}")
+                spools[part_id].size = part.size if part.complete else part.ranges.end()
+                if part.complete:
+                    print(f"[Info] part {part_id} was already received, skipped")
+                    continue
+                first = part.ranges.contiguous()
+                download = Download(part_id, self.order_replicas(replicas), spools[part_id], 0, (first, REST_OF_FILE))
+                download.reassembler.received = copy_ranges(part.ranges)
+                print(f"[Info] part {part_id} resumes at byte {first}")
+            download.track(checkpoint, part_id)
+            downloads.append(download)
+
+        self.run_downloads(downloads)
+        checkpoint.flush()
+        for spool in spools.values():
+            spool.close()
+
+        # Put the parts together in tracker ID order, the same way receive_file appends them.
+        # Whatever an interrupted earlier assembly appended is cut off first.
+        if checkpoint.all_complete():
+            with OutputFile(self.file_option) as output:
+                output.size = min(part.base_offset for part in checkpoint.parts.values())
+                for part_id, _ in self.tracker_info[self.file_option]:
+                    # Check if there is content in the file already
+                    if output.size != 0:
+                        output.append(b"\n") # Make a new line
+                    with open(f"{self.file_option}.part{part_id}", "rb") as part:
+                        for chunk in iter(lambda: part.read(1 << 20), b""):
+                            output.append(chunk)
+                output.sync()
+            checkpoint.close(remove=True)
+            for part_id in spools:
+                os.remove(f"{self.file_option}.part{part_id}")
+        else:
+            checkpoint.close()
+            print(f"[Warning] {self.file_option} is still missing bytes, run the requester again to fetch them")
+
+        self.pktlog.flush() # The per-packet log comes before the summaries
+        for download in downloads:
+            self.log_download(download)
+
+    # Fetch one file that every sender in tracker.txt holds in full, split in work units of
+    # self.stripe bytes that the Scheduler hands out as the senders finish their ranges.
+    # The senders have to run in server mode (-s) to take several requests.
+    def fetch_striped(self) -> None:
+        senders = [] # Every sender once, in tracker order
+        for _, replicas in self.tracker_info[self.file_option]:
+            senders += [replica for replica in replicas if replica not in senders]
+
+        with OutputFile(self.file_option) as output:
+            checkpoint = self.open_checkpoint(output)
+            part = checkpoint.parts.get(0) # The whole file is part 0 of the checkpoint
+            if part is None:
+                # Check if there is content in the file already
+                if output.size != 0:
+                    output.append(b"\n") # Make a new line
+                part = checkpoint.start_part(0, output.size)
+            scheduler = Scheduler(senders, output, part.base_offset, self.stripe, checkpoint)
+            if not part.complete:
+                self.run_downloads(scheduler.start(), scheduler.next_download)
+                scheduler.finish()
+            checkpoint.close(remove=checkpoint.all_complete()) # Kept only while some bytes are still missing
+        if not scheduler.downloads:
+            print(f"[Info] {self.file_option} was already received, nothing to fetch")
+            return
+
+        self.pktlog.flush() # The per-packet log comes before the summaries
+        # One summary per sender over all the ranges it sent
+        for sender in senders:
+            served = [download for download in scheduler.downloads if download.replicas[0] == sender]
+            if not served:
+                continue
+            duration = int((max(d.end_time for d in served) - min(d.start_time for d in served)) * 1000)
+            num_data_packets = sum(d.num_data_packets for d in served)
+            self.log_Summary(sender[0], sender[1], num_data_packets, sum(d.total_byte for d in served), duration, round(num_data_packets / (max(duration, 1) / 1000)))
+        scheduler.log_utilization()
+
+    # This function receives one part into the output file and logs all the info
+    def receive_file(self, part_id: int, replicas: List[Replica], output: OutputFile, checkpoint: Checkpoint) -> None:
+        part = checkpoint.parts.get(part_id) # What an interrupted run already received of the part
+        if part is not None and part.complete:
+            print(f"[Info] part {part_id} was already received, skipped")
+            return
+
+        if part is None:
+            # Check if there is content in the file already
+            if output.size != 0:
+                output.append(b"\n") # Make a new line
+            part = checkpoint.start_part(part_id, output.size) # The part starts at the current end
+            download = Download(part_id, self.order_replicas(replicas), output, part.base_offset)
+        else:
+            # Only ask for the part from its first missing byte on
+            first = part.ranges.contiguous()
+            download = Download(part_id, self.order_replicas(replicas), output, part.base_offset, (first, REST_OF_FILE))
+            download.reassembler.received = copy_ranges(part.ranges)
+            print(f"[Info] part {part_id} resumes at byte {first}")
+        download.track(checkpoint, part_id)
+        self.run_downloads([download])
+
+        self.pktlog.flush() # The per-packet log comes before the summary
+        self.log_download(download) # Log the summary
+
+    # Fastest replicas first, the ones never asked before keep their tracker order in front so they get measured
+    def order_replicas(self, replicas: List[Replica]) -> List[Replica]:
+        return sorted(replicas, key=lambda replica: self.replica_latency.get(replica, 0.0))
+
+    # Request the parts and receive until all of them are complete. Packets of different
+    # parts arrive interleaved on the one socket, the sender address tells them apart.
+    # next_download may return another download to start whenever one is complete.
+    def run_downloads(self, downloads: List["Download"], next_download: Callable[["Download"], Optional["Download"]] = None) -> None:
+        self.routes = {}
+        downloads = [download for download in downloads if download is not None]
+        for download in downloads:
+            self.request_replica(download)
+
+        remaining = len(downloads)
+        while remaining > 0:
+            # Wake up in time to hedge the part that will stall first, a part is never hedged while hedging is off
+            hedge_at = min((d.hedge_at for d in downloads if not d.done and d.can_hedge() and math.isfinite(d.hedge_at)), default=None)
+            now = time.time()
+            if hedge_at is not None and hedge_at <= now:
+                for download in downloads:
+                    if not download.done and download.can_hedge() and download.hedge_at <= now:
+                        self.request_replica(download)
+                continue
+            self.sock.settimeout(None if hedge_at is None else hedge_at - now)
+
+            try:
+                nbytes, req_addr = self.sock.recvfrom_into(self.buffer) # Get the packet and sender address from socket
+            except socket.timeout:
+                continue
+            download = self.routes.get(req_addr)
+            if download is None or download.done:
+                continue # Not one of the senders asked, or a slower replica of a part already complete
+
+            self.sender_ports.append(req_addr[0]) # Get the address
+            self.heard_from(download, req_addr)
+            self.handle_packet(download, self.view[:nbytes], req_addr)
+
+            # The packet may also have completed a range another download shares with this one
+            for finished in [download] + [d for d in download.partners if not d.done and d.covered()]:
+                if not finished.done:
+                    finished.finish_covered()
+                if finished.done and not finished.counted:
+                    finished.counted = True
+                    remaining -= 1
+                    following = next_download(finished) if next_download is not None else None
+                    if following is not None:
+                        downloads.append(following)
+                        self.request_replica(following)
+                        remaining += 1
+        self.sock.settimeout(None)
+
+    # Ask the next replica of a part for it, returns False when every replica was asked already
+    def request_replica(self, download: "Download") -> bool:
+        if not download.can_hedge():
+            return False
+        replica = download.replicas[download.requested]
+        if download.requested > 0:
+            print(f"[Info] part {download.part_id} stalled, also requesting it from {replica[0]}:{replica[1]}")
+        download.requested += 1
+        download.requested_at[replica] = time.time()
+        download.hedge_at = download.requested_at[replica] + self.gaps.threshold()
+        self.routes[replica] = download
+        self.sock.sendto(self.header + codec.pack_request(self.file_option, download.byte_range), replica)
+        return True
+
+    # Measure the silence before a packet and push the hedge deadline of its part back
+    def heard_from(self, download: "Download", replica: Replica) -> None:
+        now = time.time()
+        if replica not in download.answered:
+            download.answered.add(replica)
+            self.replica_latency[replica] = now - download.requested_at[replica]
+        if download.last_heard is not None:
+            self.gaps.add(now - download.last_heard)
+        else:
+            self.gaps.add(now - download.start_time)
+        download.last_heard = now
+        download.hedge_at = now + self.gaps.threshold()
+
+    # Place one DATA packet or finish on the END packet
+    def handle_packet(self, download: "Download", packet: memoryview, replica: Replica) -> None:
+        request_type, sequence, length = codec.unpack_inner(packet) # Unpack the header
+
+        # A range completed before its END arrived, the sender is already on its next range
+        if request_type == codec.END and not download.owns_end(sequence, length):
+            return
+
+        # Check if the type is D or not
+        if download.num_data_packets == 0 and request_type != codec.DATA:
+            print(f"[Error] first packet recived should be a request with request type 'D', but got {request_type.decode()} instead.")
+
+        if request_type == codec.DATA:
+            payload = packet[codec.INNER_SIZE:] # Get the payload
+            download.add(sequence, payload, length, replica) # Write it at its offset, whatever order it came in
+            self.log_info(replica[0], replica[1], "D", sequence, length, payload) # Log the info of the DATA packet
+        elif request_type == codec.END:
+            self.log_info(replica[0], replica[1], "E", sequence, 0, b"") # Log the info of the END packet
+            if download.byte_range is not None:
+                download.file_size = length # The END of a range request carries the size of the whole file
+            # Bytes lost on the way are sent again in full by another replica when there is one left
+            if download.missing(sequence) and self.request_replica(download):
+                return
+            missing = download.finish(sequence)
+            if missing and all(partner.done for partner in download.partners): # A partner still sending may fill the holes
+                print(f"[Error] {sum(end - start for start, end in missing)} bytes from {download.address}:{download.port} never arrived")
+
+    # Log the summary of one part
+    def log_download(self, download: "Download") -> None:
+        duration = int((download.end_time - download.start_time) * 1000) # Get the time it took to complete all the packets
+        avg_time_per_packet = round(download.num_data_packets / (max(duration, 1) / 1000)) # Get the average time for each packet
+        self.log_Summary(download.address, download.port, download.num_data_packets, download.total_byte, duration, avg_time_per_packet) # Log the summary
+
+    # Function that logs the info, only recorded here and formatted by format_info later
     def log_info(self, sender_address: str, sender_port: str, type: Literal["D", "E"], seq: int, length: int, payload: bytes) -> None:
-        # Check if it's a DATA packet ("D") or END packet ("E") and print the info
+        self.pktlog.record(type, seq, length, payload, (sender_address, sender_port))
+
+    # Format one logged packet
+    @staticmethod
+    def format_info(type: str, when: float, seq: int, length: int, sender: Tuple[str, int], payload: bytes) -> str:
+        # Check if it's a DATA packet ("D") or END packet ("E") and format the info
         if type == "D":
-            print(f"DATA Packet")
-            print(f"recv time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
-            print(f"sender addr: {sender_address}:{sender_port}")
-            print(f"Sequence num: {seq}")
-            print(f"length: {length}")
-            print(f"payload: {payload[:4].decode()}")
-            print(f"")
-        elif type == "E":
-            print(f"END Packet")
-            print(f"recv time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
-            print(f"sender addr: {sender_address}:{sender_port}")
-            print(f"Sequence num: {seq+1}")
-            print(f"length: {length}")
-            print(f"payload: 0")
-            print(f"")
+            return (f"DATA Packet\n"
+                    f"recv time: {format_time(when)}\n"
+                    f"sender addr: {sender[0]}:{sender[1]}\n"
+                    f"Sequence num: {seq}\n"
+                    f"length: {length}\n"
+                    f"payload: {payload.decode(errors='replace')}\n"
+                    f"\n")
+        return (f"END Packet\n"
+                f"recv time: {format_time(when)}\n"
+                f"sender addr: {sender[0]}:{sender[1]}\n"
+                f"Sequence num: {seq+1}\n"
+                f"length: {length}\n"
+                f"payload: 0\n"
+                f"\n")
 
     # This function logs the summary
     def log_Summary(self, sender_address: str, sender_port: str, num_data_packets: int, total_byte: int, duration: int, avg_time_per_packet: int,) -> None:
+        if not self.pktlog.summaries():
+            return
         print("Summary")
         print(f"sender addr: {sender_address}:{sender_port}")
         print(f"Total Data packets: {num_data_packets}")
@@ -131,6 +382,262 @@ class Requester:
         print(f"Duration of the test: {duration}ms")
         print("")
 
+# Percentile of the recent gaps between packets, decides how long a part may be silent before it is hedged
+class LatencyTracker:
+    # Initialize function, a percentile of 0 turns hedging off
+    def __init__(self, percentile: int) -> None:
+        self.percentile = percentile
+        self.samples = deque(maxlen=LATENCY_SAMPLES) # Most recent gaps in seconds
+        self.cached = None # Threshold computed from the samples, dropped every LATENCY_SAMPLES // 8 new ones
+        self.added = 0
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.added += 1
+        if self.added % (LATENCY_SAMPLES // 8) == 0 or len(self.samples) < 8:
+            self.cached = None
+
+    # Seconds of silence after which a part is hedged
+    def threshold(self) -> float:
+        if self.percentile <= 0:
+            return float("inf")
+        if not self.samples:
+            return INITIAL_HEDGE_DELAY
+        if self.cached is None:
+            ordered = sorted(self.samples)
+            value = ordered[min(len(ordered) - 1, len(ordered) * self.percentile // 100)]
+            self.cached = max(MIN_HEDGE_DELAY, value * HEDGE_FACTOR)
+        return self.cached
+
+# What the scheduler knows about one sender
+class SenderStats:
+    # Initialize function
+    def __init__(self, replica: Replica) -> None:
+        self.replica = replica # Address and port of the sender
+        self.throughput = None # Estimated bytes per second, None until a range was measured
+        self.busy = 0.0 # Seconds the sender had a range outstanding
+        self.ranges = 0 # Ranges handed to the sender
+        self.steals = 0 # Ranges it took over from slower senders
+        self.bytes = 0 # Payload bytes it sent
+
+    # Fold a finished range into the throughput estimate
+    def measure(self, download: "Download") -> None:
+        elapsed = max(download.end_time - download.start_time, 1e-6)
+        self.busy += elapsed
+        self.bytes += download.total_byte
+        rate = download.total_byte / elapsed
+        self.throughput = rate if self.throughput is None else THROUGHPUT_WEIGHT * rate + (1 - THROUGHPUT_WEIGHT) * self.throughput
+
+# Work-stealing scheduler for a file striped across senders. The file is split in work units,
+# a sender that finishes its range gets the next units, as many as it is expected to send in
+# TARGET_REQUEST_TIME. Once every unit is handed out (endgame), an idle sender takes over the
+# second half of what the slowest sender still has to send.
+class Scheduler:
+    # Initialize function
+    def __init__(self, senders: List[Replica], output: OutputFile, base_offset: int, unit: int, checkpoint: Checkpoint = None) -> None:
+        self.senders = senders # Senders holding the file
+        self.output = output # File the ranges are written to
+        self.base_offset = base_offset # Where the file starts in the output
+        self.unit = unit # Bytes in one work unit
+        self.reassembler = Reassembler(output, base_offset) # Shared by every range, so a byte that arrives twice is written once
+        self.stats = {sender: SenderStats(sender) for sender in senders}
+        self.downloads: List[Download] = [] # Every range requested
+        self.next_offset = 0 # Start of the first unit not handed out yet
+        self.file_size = None # Size of the file, known from the first END packet
+        self.retry: List[Tuple[int, int]] = [] # Byte ranges that were handed out but never arrived
+        self.start_time = time.time()
+        self.checkpoint = checkpoint # Records the ranges received as part 0, an interrupted run resumes from it
+        part = checkpoint.parts.get(0) if checkpoint is not None else None
+        if part is not None:
+            self.reassembler.received = copy_ranges(part.ranges)
+            self.file_size = part.size
+
+    # The first range of every sender
+    def start(self) -> List["Download"]:
+        self.start_time = time.time()
+        return [self.assign(sender) for sender in self.senders]
+
+    # Record the size and completion of the file in the checkpoint
+    def finish(self) -> None:
+        if self.checkpoint is None or self.file_size is None:
+            return
+        self.checkpoint.set_size(0, self.file_size)
+        if not self.reassembler.received.missing(self.file_size):
+            self.checkpoint.complete(0)
+
+    # Called when a range is complete, returns the next range for the same sender
+    def next_download(self, download: "Download") -> Optional["Download"]:
+        if download.file_size is not None and self.file_size is None:
+            self.file_size = download.file_size
+            # Ranges handed out before the size was known may reach past the end of the file
+            for other in self.downloads:
+                if other.first + other.byte_range[1] > self.file_size:
+                    other.byte_range = (other.first, max(0, self.file_size - other.first))
+        self.stats[download.replicas[0]].measure(download)
+        # Bytes of the range that never arrived are handed out again, unless a partner may still send them
+        if self.file_size is not None and all(partner.done for partner in download.partners):
+            self.retry += self.reassembler.received.missing(min(download.first + download.byte_range[1], self.file_size), download.first)
+        return self.assign(download.replicas[0])
+
+    # Hand the next units to a sender, or part of a slow sender's range once none are left
+    def assign(self, sender: Replica) -> Optional["Download"]:
+        if self.retry:
+            start, end = self.retry.pop(0)
+            return self.add(sender, (start, end - start))
+        # Units an interrupted run already received are skipped
+        while self.reassembler.received.contains(self.next_offset, self.next_offset + self.unit):
+            self.next_offset += self.unit
+        if self.file_size is not None and self.next_offset >= self.file_size:
+            return self.steal(sender)
+
+        length = self.units_for(sender) * self.unit
+        if self.file_size is not None:
+            length = min(length, self.file_size - self.next_offset)
+        download = self.add(sender, (self.next_offset, length))
+        self.next_offset += length
+        return download
+
+    # Units for one range, enough to keep the sender busy for TARGET_REQUEST_TIME but no more than its share of what is left
+    def units_for(self, sender: Replica) -> int:
+        throughput = self.stats[sender].throughput
+        if throughput is None:
+            return 1
+        units = max(1, min(MAX_UNITS_PER_REQUEST, round(throughput * TARGET_REQUEST_TIME / self.unit)))
+        if self.file_size is not None:
+            units_left = -(-(self.file_size - self.next_offset) // self.unit)
+            units = min(units, max(1, units_left // len(self.senders)))
+        return units
+
+    # Endgame: take over the second half of the missing bytes of the range expected to finish last
+    def steal(self, sender: Replica) -> Optional["Download"]:
+        best, best_time, best_holes = None, 0.0, None
+        for download in self.downloads:
+            if download.done or download.replicas[0] == sender or download.partners:
+                continue
+            holes = self.reassembler.received.missing(download.first + download.byte_range[1], download.first)
+            left = sum(end - start for start, end in holes)
+            throughput = self.stats[download.replicas[0]].throughput or 1.0
+            if left > self.unit and left / throughput > best_time:
+                best, best_time, best_holes = download, left / throughput, holes
+
+        # Only worth it if the sender can send its half before the victim is done with all of it
+        thief_throughput = self.stats[sender].throughput
+        if best is None or (thief_throughput is not None and thief_throughput * best_time < sum(end - start for start, end in best_holes) / 2):
+            return None
+        # The victim sends its range in order, so it keeps the first half and the thief starts halfway
+        half = sum(end - start for start, end in best_holes) // 2
+        for start, end in best_holes:
+            if end - start > half:
+                split = start + half
+                break
+            half -= end - start
+        range_end = best.first + best.byte_range[1]
+        download = self.add(sender, (split, range_end - split))
+        download.partners.append(best)
+        best.partners.append(download)
+        self.stats[sender].steals += 1
+        print(f"[Info] {sender[0]}:{sender[1]} takes over bytes {split}-{range_end} from {best.replicas[0][0]}:{best.replicas[0][1]}")
+        return download
+
+    def add(self, sender: Replica, byte_range: Tuple[int, int]) -> "Download":
+        download = Download(len(self.downloads) + 1, [sender], self.output, self.base_offset, byte_range, self.reassembler)
+        download.track(self.checkpoint, 0, whole_part=False)
+        self.downloads.append(download)
+        self.stats[sender].ranges += 1
+        return download
+
+    # Report how busy every sender was
+    def log_utilization(self) -> None:
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        for sender, stats in self.stats.items():
+            print("Utilization")
+            print(f"sender addr: {sender[0]}:{sender[1]}")
+            print(f"Ranges: {stats.ranges} ({stats.steals} taken over)")
+            print(f"Throughput: {round(stats.throughput or 0)} bytes/second")
+            print(f"Busy: {round(100 * min(stats.busy / elapsed, 1))}%")
+            print("")
+
+# State of one part being received, from one or more replicas
+class Download:
+    # Initialize function
+    def __init__(self, part_id: int, replicas: List[Replica], output: OutputFile, base_offset: int, byte_range: Tuple[int, int] = None,
+                 reassembler: Reassembler = None) -> None:
+        self.part_id = part_id # ID of the part in tracker.txt, or number of the range
+        self.replicas = replicas # Senders holding the part, asked in this order
+        self.byte_range = byte_range # (offset, length) asked for, None for the whole part
+        self.first = byte_range[0] if byte_range is not None else 0 # Offset of the first byte asked for
+        self.file_size = None # Size of the whole file, sent back with the END of a range request
+        self.address, self.port = replicas[0] # Sender the part came from, the first one that sent data
+        self.output = output # File the part is written to
+        self.reassembler = reassembler or Reassembler(output, base_offset) # Places the payloads at their offsets, may be shared by the ranges of one file
+        self.num_data_packets = 0 # Number of DATA packets
+        self.total_byte = 0 # Number of payload bytes
+        self.start_time = time.time() # When the request was sent
+        self.end_time = None # When the END packet arrived
+        self.done = False # Whether the END packet arrived
+        self.requested = 0 # Number of replicas asked so far
+        self.requested_at: Dict[Replica, float] = {} # When each replica was asked
+        self.answered = set() # Replicas that sent something
+        self.last_heard = None # When the last packet of the part arrived
+        self.hedge_at = float("inf") # When the next replica is asked if nothing arrives
+        self.partners: List["Download"] = [] # Downloads of the same bytes from other senders, whichever is first completes both
+        self.counted = False # Whether the download loop has counted it as complete
+        self.checkpoint = None # Journal the received ranges are recorded in
+        self.checkpoint_key = 0 # Part of the checkpoint the download belongs to
+        self.whole_part = True # Whether the END of the download is the end of its checkpoint part
+
+    # Record every range received in a checkpoint part. A download that is only one range of
+    # the part leaves its size and completion to whoever knows the whole part.
+    def track(self, checkpoint: Optional[Checkpoint], key: int, whole_part: bool = True) -> None:
+        self.checkpoint = checkpoint
+        self.checkpoint_key = key
+        self.whole_part = whole_part
+
+    # Whether there is a replica left to ask
+    def can_hedge(self) -> bool:
+        return self.requested < len(self.replicas)
+
+    # Write the payload of a DATA packet at the offset its sequence number gives
+    def add(self, sequence: int, payload: memoryview, length: int, replica: Replica) -> None:
+        if self.num_data_packets == 0:
+            self.address, self.port = replica
+        if self.reassembler.write(sequence - FIRST_SEQ, payload) and self.checkpoint is not None:
+            self.checkpoint.add(self.checkpoint_key, sequence - FIRST_SEQ, sequence - FIRST_SEQ + len(payload))
+        self.num_data_packets += 1
+        self.total_byte += length
+
+    # The byte ranges still missing if the part ended at this END sequence number
+    def missing(self, sequence: int) -> List[Tuple[int, int]]:
+        return self.reassembler.received.missing(max(sequence - FIRST_SEQ, self.reassembler.received.end()), self.first)
+
+    # Whether an END packet can be the end of this download and not of an earlier range of the same sender.
+    # A range that starts past the end of the file ends at the end of the file, which the END length gives.
+    def owns_end(self, sequence: int, file_size: int) -> bool:
+        end = sequence - FIRST_SEQ
+        return self.byte_range is None or self.first <= end <= self.first + self.byte_range[1] or end == file_size <= self.first
+
+    # Whether every byte of the range already arrived, through this download or a partner
+    def covered(self) -> bool:
+        return self.byte_range is not None and self.reassembler.received.contains(self.first, self.first + self.byte_range[1])
+
+    # Complete a range whose bytes all arrived before its own END packet
+    def finish_covered(self) -> None:
+        if self.covered():
+            self.end_time = time.time()
+            self.done = True
+
+    # Mark the part as complete, the END sequence number is one past the last byte.
+    # Returns the byte ranges that never arrived.
+    def finish(self, sequence: int) -> List[Tuple[int, int]]:
+        self.end_time = time.time()
+        self.done = True
+        missing = self.reassembler.finish(sequence - FIRST_SEQ, self.first)
+        if self.checkpoint is not None and self.whole_part:
+            self.checkpoint.set_size(self.checkpoint_key, sequence - FIRST_SEQ)
+            if not self.reassembler.received.missing(sequence - FIRST_SEQ):
+                self.checkpoint.complete(self.checkpoint_key)
+        return missing
+
 # Main function
 def main():
     # Make a parser to parse arguments
@@ -139,6 +646,10 @@ def main():
     # Add arguments
     parser.add_argument("-p", type=int, required=True) # Add port argument
     parser.add_argument("-o", type=str, required=True) # Add output file argument
+    parser.add_argument("-a", action="store_true") # Fetch all the parts at the same time
+    parser.add_argument("-S", type=int, default=0) # Stripe one file every sender holds across all of them in work units of this many bytes
+    parser.add_argument("-H", type=int, default=HEDGE_PERCENTILE) # Latency percentile after which a stalled part is requested from another replica, 0 turns it off
+    add_log_arguments(parser, "full") # Per-packet logging options
 
     # Parse the arguments
     args = parser.parse_args()
@@ -148,7 +659,8 @@ def main():
         exit()
     else:
         # Call class Requester to request for the packets
-        Requester(args.p, args.o)
+        pktlog = PacketLog(args.log_level, args.log_format, args.log_file, Requester.format_info, args.log_sample)
+        Requester(args.p, args.o, args.a, pktlog, args.H, args.S)
 
 
 # Calls the main function
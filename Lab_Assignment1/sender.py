@@ -1,123 +1,328 @@
 import argparse
 import socket
-import struct
-import math
-import time
-from typing import Literal
-from datetime import datetime
+import mmap
+import os
+import sys
+import asyncio
+from itertools import islice
+from typing import Literal, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)) # Make the shared modules importable
+from common.pacer import Pacer
+from common.batch import MAX_BATCH, BatchSender
+from common import codec
+from common.chunkcache import ChunkCache
+from common.pktlog import PacketLog, add_log_arguments, format_time
+
+MIN_ASYNC_SLEEP = 0.001 # Shortest wait worth handing to the event loop in server mode
+CACHE_SIZE = 64 # Default size of the packet cache in server mode, in MB
+
+# Lazily split a file view into payload slices, yields (sequence number, payload, is last packet)
+def chunk_file(view: memoryview, seq_no: int, length: int):
+    file_size = len(view) # Get the size of the file
+
+    # An empty file is still sent as one empty DATA packet
+    if file_size == 0:
+        yield seq_no, view[0:0], True
+        return
+
+    # Slicing a memoryview does not copy, so only one payload is referenced at a time
+    for offset in range(0, file_size, length):
+        payload = view[offset : offset + length]
+        yield seq_no + offset, payload, offset + length >= file_size
+
+# Packets made lazily from a file view, yields (sequence number, packet, payload, is last packet)
+def file_packets(view: memoryview, seq_no: int, length: int):
+    for seq, payload, is_last in chunk_file(view, seq_no, length):
+        yield seq, (codec.pack_inner(codec.DATA, seq, len(payload)), payload), payload, is_last
+
+# Clamp a requested byte range to the file, returns (offset, end). None means the whole file.
+def clamp_range(file_size: int, byte_range: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    if byte_range is None:
+        return 0, file_size
+    offset = min(byte_range[0], file_size)
+    return offset, min(file_size, offset + byte_range[1])
+
+# The DATA packets of a requested file or byte range of it, made lazily from the file contents
+# in the cache when there is one, otherwise from a memory map. The payloads are slices of the
+# contents, only the headers are packed for every request.
+# The sequence number of a byte is seq_no + its offset in the file, whatever range was asked for.
+class PacketSource:
+    # Initialize function, opens the file unless the cache has it
+    def __init__(self, filename: str, length: int, seq_no: int, byte_range: Optional[Tuple[int, int]] = None,
+                 cache: Optional[ChunkCache] = None) -> None:
+        self.length = length # Length of payload (in bytes) in the packets
+        self.seq_no = seq_no # Sequence number of the first byte of the file
+        self.content = None # Memory map of the file when it is not cached
+        data = cache.content(filename) if cache is not None else None # The file contents, if they are cached
+        if data is None:
+            with open(filename, "rb") as f:
+                if os.fstat(f.fileno()).st_size > 0:
+                    self.content = data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    data = b"" # An empty file cannot be mapped
+        self.file_size = len(data) # Get the size of the file
+        self.offset, self.end = clamp_range(self.file_size, byte_range)
+        self.window = memoryview(data)[self.offset : self.end] # View of the requested range
+
+    def __enter__(self) -> "PacketSource":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # Yields (sequence number, packet, payload, is last packet)
+    def chunks(self):
+        return file_packets(self.window, self.seq_no + self.offset, self.length)
+
+    def close(self) -> None:
+        if self.window is not None:
+            self.window.release()
+            self.window = None
+        if self.content is not None:
+            self.content.close()
+        self.content = None
 
 # This class send packets to the requester
 class Sender:
     # Initialize function
-    def __init__(self, port: int, requester_port: int, rate: int, seq_no: int, length: int) -> None:
+    def __init__(self, port: int, requester_port: int, rate: int, seq_no: int, length: int, burst: int = 1, server: bool = False, pktlog: PacketLog = None, cache_size: int = CACHE_SIZE) -> None:
         self.listen_port = port # Port on which the sender waits for requests
         self.requester_port = requester_port # Port on which the requester is waiting
         self.requester_address = None # Address of the requester
         self.rate = rate # Number of packets per second
+        self.burst = max(1, burst) # Number of packets that may be sent back to back
+        self.pacer = Pacer(rate, self.burst) # Paces the DATA packets to the rate
+        # Packets read ahead for one batch: a burst while pacing, as many as one system call takes without it
+        self.lookahead = self.burst if rate > 0 else MAX_BATCH
         self.seq_no = seq_no # Sequence number
         self.length = length # Length of payload (in bytes) in the packets
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # Create a socket
         self.UDP_IP = socket.gethostbyname(socket.gethostname())
         self.sock.bind((self.UDP_IP, self.listen_port)) # Bind the socket with the port and UDP IP
-        self.sock.settimeout(60)
-        self.listen_to_request() # Calls function "listen_to_request"
+        self.batch = BatchSender(self.sock) # Sends the packets let through by the pacer together
+        self.pktlog = pktlog or PacketLog(formatter=self.format_info) # Per-packet log, written out off the send path
+        # Only a sender that keeps serving can see the same file twice, so only it caches packets
+        self.cache = ChunkCache(cache_size << 20) if server and cache_size > 0 else None
+
+        # Check if the sender should keep serving requests or serve only one
+        try:
+            if server:
+                self.serve_forever() # Calls function "serve_forever"
+            else:
+                self.sock.settimeout(60)
+                self.listen_to_request() # Calls function "listen_to_request"
+        finally:
+            self.pktlog.close() # Write out what is left of the per-packet log
 
     # This function listens to the request
     def listen_to_request(self) -> None:
         try:
             packet, req_addr = self.sock.recvfrom(8192) # Get the packet and requester address
             self.requester_address = req_addr[0] # Get the requester address
-            header = packet[:9] # Get the header
-            payload = packet[9:] # Get the payload
-            headers = struct.unpack("!cII", header) # Unpack the header
-            request_type, file_requested = headers[0].decode(), payload.decode() # Get the request type and the file that is requested
+            headers = codec.unpack_inner(packet) # Unpack the header
+            request_type = headers[0].decode() # Get the request type
+            file_requested, byte_range = codec.unpack_request(packet[codec.INNER_SIZE:]) # Get the file that is requested and the part of it wanted
+            self.seq_no = headers[1] or self.seq_no # The requester may pick the first sequence number, 0 keeps ours
             # Check if the request type is R
             if request_type != "R":
                 print(
                     f"[Error] Should get a request with request type 'R', but got {request_type} instead."
                 )
 
-            self.send_file(file_requested) # Calls function "send_file" 
+            self.send_file(file_requested, byte_range) # Calls function "send_file"
         except TimeoutError:
             print("[Error] Waited too long for the request, exiting...")
 
-    # This function sends the file to the requester
-    def send_file(self, filename: str) -> None:
-        # read in the requested file
-        content = b""
-        with open(filename, "r") as f:
-            content = f.read().encode()
-
-        file_size = len(content) # Get the size of the file
-
-        last_payload_length = 0 # Variable for the very last payload in DATA packet
-
-        headers = [] # For the headers
-        seq_nums = [] # For the sequence numbers
-
-        # Check if the file size is smaller than the length
-        if file_size <= self.length:
-            headers.append(struct.pack("!cII", "D".encode(), socket.htonl(self.seq_no), file_size)) # Append the current header
-            seq_nums.append(self.seq_no) # Append the current sequence number
-            self.seq_no += file_size # Add the file size to the total sequence number
-            last_payload_length = file_size # Get the length of the payload
-        else:
-            num_packets = math.ceil(file_size / self.length) # Get the number of packets
-            last_payload_length = file_size % self.length # Get the length of the last payload
-            
-            # Loop through all the packets
-            for i in range(num_packets):
-                # Check if it's the last packet or not
-                if i == num_packets - 1:
-                    # last packet
-                    headers.append(struct.pack("!cII", "D".encode(), socket.htonl(self.seq_no), last_payload_length)) # Append the current header
-                    seq_nums.append(self.seq_no) # Append the current sequence number
-                    self.seq_no += last_payload_length # Add the length to the total sequence number
+    # This function sends the file, or only the byte range asked for, to the requester
+    def send_file(self, filename: str, byte_range: Tuple[int, int] = None) -> None:
+        with PacketSource(filename, self.length, self.seq_no, byte_range, self.cache) as source:
+            last_payload_length = self.send_packets(source.chunks())
+
+        # send END packet, a range request also learns the size of the whole file from it
+        end_length = min(source.file_size, 0xFFFFFFFF) if byte_range is not None else 0
+        self.sock.sendto(codec.pack_inner(codec.END, self.seq_no, end_length), (self.requester_address, self.requester_port))
+        self.log_info("E", self.seq_no, last_payload_length, b"") # Logo info of END packet
+        self.pktlog.flush() # The per-packet log comes before the rate
+        if self.pktlog.summaries():
+            print(f"achieved rate: {round(self.pacer.achieved_rate())} packets/second")
+
+    # Send the DATA packets with rate limit, don't need to wait for ACK. Returns the length of the last payload.
+    def send_packets(self, chunks) -> int:
+        last_payload_length = 0 # Length of the very last payload in DATA packet
+        pending = list(islice(chunks, self.lookahead)) # Packets waiting for the pacer
+        while pending:
+            count = self.pacer.take(len(pending)) # Wait for the pacer, it lets up to a burst through
+            batch = pending[:count]
+            self.batch.send([packet for _, packet, _, _ in batch], (self.requester_address, self.requester_port)) # Send the DATA packets in one call
+
+            for seq, _, payload, is_last in batch:
+                self.seq_no = seq + len(payload) # Move the sequence number past this payload
+
+                # Check if it's the last DATA packet
+                if not is_last:
+                    self.log_info("D", seq, len(payload), payload) # Log DATA packet info
                 else:
-                    headers.append(struct.pack("!cII", "D".encode(), socket.htonl(self.seq_no), self.length)) # Append the current header
-                    seq_nums.append(self.seq_no) # Append the current sequence number
-                    self.seq_no += self.length # Add the length to the total sequence number
+                    last_payload_length = len(payload)
+                    self.log_info("D", seq, (last_payload_length+1), payload) # Log DATA packet info
 
-        file_parts = [] # Variable for all the parts of the file
+                payload.release() # Release the slice so the mapping can be closed
 
-        # Loop through all the headers
-        for i in range(len(headers)):
-            file_parts.append(content[i * self.length : (i + 1) * self.length]) # Get the parts of the file of each header
+            del batch
+            pending = pending[count:] + list(islice(chunks, count)) # Refill with the next packets
+        return last_payload_length
 
-        header_and_payload = [header + payload for header, payload in zip(headers, file_parts)] # Combine the header and paylaod
+    # Serve requests from any number of requesters until the process is killed
+    def serve_forever(self) -> None:
+        self.sock.setblocking(False) # The event loop needs a non-blocking socket
+        self.transfers = {} # Running transfers, keyed by (requester address, file)
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Sender stopped")
 
-        # send the packets with rate limit, don't need to wait for ACK
-        for i in range(len(header_and_payload)):
-            self.sock.sendto(header_and_payload[i], (self.requester_address, self.requester_port)) # Send the DATA packet
+    # Accept requests on the shared socket, every transfer runs as its own task
+    async def serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(lambda: RequestProtocol(self), sock=self.sock)
+        await loop.create_future() # Never finishes, the sender serves until it is killed
 
-            # Check if it's the last DATA packet
-            if(i != len(header_and_payload) - 1):
-                self.log_info("D", seq_nums[i], self.length, file_parts[i]) # Log DATA packet info
-            else:
-                self.log_info("D", seq_nums[i], (last_payload_length+1), file_parts[i]) # Log DATA packet info
+    # Start a transfer for a request unless the same one is already running
+    def start_transfer(self, requester: Tuple[str, int], filename: str, seq_no: int = 0, byte_range: Tuple[int, int] = None) -> None:
+        key = (requester, filename, byte_range)
+        if key in self.transfers:
+            return
 
-            time.sleep(1 / self.rate)
+        transfer = Transfer(self, requester, filename, seq_no, byte_range)
+        self.transfers[key] = asyncio.ensure_future(transfer.run())
+        self.transfers[key].add_done_callback(lambda _: self.transfers.pop(key, None))
 
-        # send END packet
-        self.sock.sendto(struct.pack("!cII", "E".encode(), socket.htonl(self.seq_no), 0), (self.requester_address, self.requester_port))
-        self.log_info("E", self.seq_no, last_payload_length, b"") # Logo info of END packet
+    # Logs all the info for all the packets, only recorded here and formatted by format_info later
+    def log_info(self, type: Literal["D", "E"], seq: int, length: int, payload: bytes, requester: Tuple[str, int] = None) -> None:
+        self.pktlog.record(type, seq, length, payload, requester or (self.requester_address, self.requester_port))
 
-    # Logs all the info for all the packets
-    def log_info(self, type: Literal["D", "E"], seq: int, length: int, payload: bytes) -> None:
+    # Format one logged packet
+    @staticmethod
+    def format_info(type: str, when: float, seq: int, length: int, requester: Tuple[str, int], payload: bytes) -> str:
         if type == "D":
-            print(f"DATA Packet")
-            print(f"send time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
-            print(f"requester addr: {self.requester_address}:{self.requester_port}")
-            print(f"Sequence num: {seq}")
-            print(f"length: {length}")
-            print(f"payload: {payload[:4].decode()}")
-            print("")
-        elif type == "E":
-            print(f"send time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
-            print(f"requester addr: {self.requester_address}:{self.requester_port}")
-            print(f"Sequence num: {seq+1}")
-            print(f"length: 0")
-            print(f"payload: {payload.decode()}")
+            return (f"DATA Packet\n"
+                    f"send time: {format_time(when)}\n"
+                    f"requester addr: {requester[0]}:{requester[1]}\n"
+                    f"Sequence num: {seq}\n"
+                    f"length: {length}\n"
+                    f"payload: {payload.decode(errors='replace')}\n"
+                    f"\n")
+        return (f"send time: {format_time(when)}\n"
+                f"requester addr: {requester[0]}:{requester[1]}\n"
+                f"Sequence num: {seq+1}\n"
+                f"length: 0\n"
+                f"payload: {payload.decode(errors='replace')}\n")
+
+# Receives the requests for the sender in server mode
+class RequestProtocol(asyncio.DatagramProtocol):
+    # Initialize function
+    def __init__(self, sender: Sender) -> None:
+        self.sender = sender
+        self.writable = asyncio.Event() # Cleared while the transport buffer is full, transfers wait on it
+        self.writable.set()
+
+    # Called by the transport when its buffer fills up and again once it has drained
+    def pause_writing(self) -> None:
+        self.writable.clear()
+
+    def resume_writing(self) -> None:
+        self.writable.set()
+
+    # Called by the event loop for every datagram on the sender socket
+    def datagram_received(self, packet: bytes, req_addr: Tuple[str, int]) -> None:
+        headers = codec.unpack_inner(packet) # Unpack the header
+        request_type = headers[0].decode() # Get the request type
+        # Check if the request type is R
+        if request_type != "R":
+            print(f"[Error] Should get a request with request type 'R', but got {request_type} instead.")
+            return
+
+        filename, byte_range = codec.unpack_request(packet[codec.INNER_SIZE:]) # Get the file that is requested and the part of it wanted
+        self.sender.start_transfer(req_addr, filename, headers[1], byte_range) # Reply to the port the request came from
+
+# One file being sent to one requester in server mode, keeps its own sequence number and pacer
+class Transfer:
+    # Initialize function
+    def __init__(self, sender: Sender, requester: Tuple[str, int], filename: str, seq_no: int = 0, byte_range: Tuple[int, int] = None) -> None:
+        self.sender = sender # The sender that owns the socket
+        self.requester = requester # Address and port of the requester
+        self.filename = filename # File that is requested
+        self.byte_range = byte_range # Part of the file that is requested, None for all of it
+        self.seq_no = seq_no or sender.seq_no # Sequence number, the one asked for or the initial one
+        self.pacer = Pacer(sender.rate, sender.burst) # Paces the DATA packets of this transfer only
+
+    # Send the file, giving the event loop back to other transfers while waiting for the pacer
+    async def run(self) -> None:
+        sender = self.sender
+
+        # opening the file, or reading it into the cache on a miss, may wait on the disk, so it
+        # runs in a worker thread while the loop keeps serving the other transfers
+        loop = asyncio.get_running_loop()
+        try:
+            source = await loop.run_in_executor(None, PacketSource, self.filename, sender.length, self.seq_no, self.byte_range, sender.cache)
+        except OSError as e:
+            print(f"[Error] Cannot send {self.filename} to {self.requester[0]}:{self.requester[1]}: {e.strerror}")
+            return
+
+        with source:
+            last_payload_length = await self.send_packets(source.chunks())
+
+        # send END packet, a range request also learns the size of the whole file from it
+        end_length = min(source.file_size, 0xFFFFFFFF) if self.byte_range is not None else 0
+        sender.transport.sendto(codec.pack_inner(codec.END, self.seq_no, end_length), self.requester)
+        sender.log_info("E", self.seq_no, last_payload_length, b"", self.requester) # Logo info of END packet
+        sender.pktlog.flush() # The per-packet log comes before the rate
+        if not sender.pktlog.summaries():
+            return
+        print(f"achieved rate: {round(self.pacer.achieved_rate())} packets/second")
+        if sender.cache is not None:
+            print(sender.cache.stats())
+
+    # Send the DATA packets one at a time as the pacer lets them through, and no faster than
+    # the socket takes them. Returns the length of the last payload.
+    async def send_packets(self, chunks) -> int:
+        sender, writable = self.sender, self.sender.protocol.writable
+        last_payload_length = 0 # Length of the very last payload in DATA packet
+
+        for seq, packet, payload, is_last in chunks:
+            # Sleeps under a millisecond are not precise on the event loop, the pacer
+            # keeps the debt and the next longer sleep pays it back
+            wait = self.pacer.delay()
+            await asyncio.sleep(wait if wait >= MIN_ASYNC_SLEEP else 0)
+            if not writable.is_set():
+                await writable.wait() # The transport is still sending what the socket refused
+
+            self.send(packet) # Send the DATA packet
+            self.seq_no = seq + len(payload) # Move the sequence number past this payload
+
+            if not is_last:
+                sender.log_info("D", seq, len(payload), payload, self.requester) # Log DATA packet info
+            else:
+                last_payload_length = len(payload)
+                sender.log_info("D", seq, (last_payload_length+1), payload, self.requester) # Log DATA packet info
+
+            payload.release() # Release the slice so the mapping can be closed
+        return last_payload_length
+
+    # Send header and payload as two buffers straight from the socket. Only when the socket would
+    # block, or the transport still holds packets that must go first, does the transport take the
+    # packet: it copies it then, and pauses the protocol once its buffer fills up.
+    def send(self, packet: Tuple[bytes, memoryview]) -> None:
+        transport = self.sender.transport
+        if transport.get_write_buffer_size() == 0:
+            try:
+                self.sender.sock.sendmsg(packet, (), 0, self.requester)
+                return
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                return # Lost like any datagram, the transport would drop it as well
+        transport.sendto(b"".join(packet), self.requester)
 
 # Main function that sets up arguments and call the class "Sender"
 def main():
@@ -130,6 +335,10 @@ def main():
     parser.add_argument("-r", type=int, required=True)
     parser.add_argument("-q", type=int, required=True)
     parser.add_argument("-l", type=int, required=True)
+    parser.add_argument("-b", type=int, default=1) # Burst size of the pacer
+    parser.add_argument("-s", action="store_true") # Keep serving requests instead of exiting after one
+    parser.add_argument("-c", type=int, default=CACHE_SIZE) # Size of the packet cache in server mode in MB, 0 turns it off
+    add_log_arguments(parser, "full") # Per-packet logging options
 
     # Get the arguments from parser
     args = parser.parse_args()
@@ -139,7 +348,8 @@ def main():
         exit()
     else:
         # Call class sender to send all the packets
-        Sender(args.p, args.g, args.r, args.q, args.l)
+        pktlog = PacketLog(args.log_level, args.log_format, args.log_file, Sender.format_info, args.log_sample)
+        Sender(args.p, args.g, args.r, args.q, args.l, args.b, args.s, pktlog, args.c)
 
 # Calls main function
 if __name__ == "__main__":
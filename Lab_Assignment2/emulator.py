@@ -1,16 +1,22 @@
 import socket
 import argparse
-import struct
+import os
+import selectors
+import sys
 from typing import List, Tuple, Union
 from collections import deque
-from time import time
+from time import monotonic
 import logging
 import random
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import codec
+
 Address = Tuple[str, int]
 Table_Entry = Tuple[Tuple, Tuple, int, int]
 Queue_Entry = Tuple[bytes, float, Table_Entry]
-STRUCT_FORMAT = "!cIHIHI"
+
+RECEIVE_BATCH = 64 # Packets read at most before the held packet is checked again
 
 
 # Write our own wrapper class for the queue
@@ -26,7 +32,7 @@ class NetworkQueue:
         if len(self.queue) < self.queue_size:
             # includes current time when enqueuing in miliseconds
             self.queue.appendleft(
-                (packet, time() * 1000, entry, source, pri, length))
+                (packet, monotonic() * 1000, entry, source, pri, length))
         else:
             raise Exception("Queue is full")
 
@@ -51,14 +57,18 @@ class Emulator:
         self.UDP_IP = socket.gethostbyname(socket.gethostname())
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((self.UDP_IP, self.port))
-        # making it non-blocking
+        # making it non-blocking, the event loop reads only once the selector says a packet is there
         self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
 
         # format: Queue_Entry -> (packet, time of enque, Table_Entry, source, priority, length)
         self.currently_delaying: Union[Queue_Entry, None] = None
 
         # format: Table_Entry -> (destination, next_hop, delay, loss_prob)
         self.forwarding_table = self.read_forwarding_table()
+        # same entries keyed by (packed dest addr, dest port), so a packet header can be looked up directly
+        self.routes = {(codec.ip_to_int(e[0][0]), e[0][1]): e for e in self.forwarding_table}
 
         self.high_priority_queue = NetworkQueue(self.queue_size)
         self.medium_priority_queue = NetworkQueue(self.queue_size)
@@ -93,72 +103,72 @@ class Emulator:
 
     def route_packet(self, incoming_packet: bytes) -> None:
 
-        if incoming_packet != None:
-
-            # unpack the packet
-            header = incoming_packet[:17]
-            payload = incoming_packet[17:]
-            priority, src_addr, src_port, dest_addr, dest_port, length = struct.unpack(
-                STRUCT_FORMAT, header
-            )
-            priority = int(priority.decode())
-            src_addr = socket.inet_ntoa(src_addr.to_bytes(4, byteorder='big'))
-            dest_addr = socket.inet_ntoa(
-                dest_addr.to_bytes(4, byteorder='big'))
-            destination = (dest_addr, int(dest_port))
-            curr_entry = self.lookup_by_destination(destination)
-
-            if not curr_entry:
-                self.log("No forwarding entry found", src_addr, src_port,
-                         dest_addr, dest_port, priority, length)
-                return
-
-            packet_type, seq, _ = struct.unpack("!cII", payload[:9])
-
-            try:
-                if packet_type == b"E":
-                    self.end_packet_queue.enqueue(
-                        incoming_packet, curr_entry, (src_addr, src_port), priority, length)
-                elif priority == 1:
-                    self.high_priority_queue.enqueue(
-                        incoming_packet, curr_entry, (src_addr, src_port), priority, length)
-                elif priority == 2:
-                    self.medium_priority_queue.enqueue(
-                        incoming_packet, curr_entry, (src_addr, src_port), priority, length)
-                elif priority == 3:
-                    self.low_priority_queue.enqueue(
-                        incoming_packet, curr_entry, (src_addr, src_port), priority, length)
-            except:
-                self.log(f"Dropped because queue {priority} is full",
-                             src_addr, src_port, dest_addr, dest_port, priority, length)
-
-        # get a packet from the queues if there's no currently delayed packet
-        if not self.currently_delaying:
-            for i, Q in enumerate([self.high_priority_queue, self.medium_priority_queue, self.low_priority_queue, self.end_packet_queue]):
-                if Q.peek():
-                    self.currently_delaying = Q.dequeue()
-                    break
-        else:
-            # decide if the delay is over and should be forwarded
-            if time() * 1000 - self.currently_delaying[1] >= self.currently_delaying[2][2]:
+        # unpack the packet, addresses stay packed ints until something is logged
+        priority, src_addr, src_port, dest_addr, dest_port, length = codec.unpack_outer(incoming_packet)
+        priority = int(priority.decode())
+        curr_entry = self.routes.get((dest_addr, dest_port))
+        src_addr = codec.int_to_ip(src_addr)
+
+        if not curr_entry:
+            self.log("No forwarding entry found", src_addr, src_port,
+                     codec.int_to_ip(dest_addr), dest_port, priority, length)
+            return
+
+        packet_type = incoming_packet[codec.OUTER_SIZE:codec.OUTER_SIZE + 1]
+        dest_addr = curr_entry[0][0]
+
+        try:
+            if packet_type == b"E":
+                self.end_packet_queue.enqueue(
+                    incoming_packet, curr_entry, (src_addr, src_port), priority, length)
+            elif priority == 1:
+                self.high_priority_queue.enqueue(
+                    incoming_packet, curr_entry, (src_addr, src_port), priority, length)
+            elif priority == 2:
+                self.medium_priority_queue.enqueue(
+                    incoming_packet, curr_entry, (src_addr, src_port), priority, length)
+            elif priority == 3:
+                self.low_priority_queue.enqueue(
+                    incoming_packet, curr_entry, (src_addr, src_port), priority, length)
+        except:
+            self.log(f"Dropped because queue {priority} is full",
+                         src_addr, src_port, dest_addr, dest_port, priority, length)
 
-                # do not drop end packet, but still delays it
-                if self.check_packet_type(self.currently_delaying[0]) == b"E":
+        if not self.currently_delaying:
+            self.take_next()
+
+    # get a packet from the queues if there's no currently delayed packet
+    def take_next(self) -> None:
+        for Q in [self.high_priority_queue, self.medium_priority_queue, self.low_priority_queue, self.end_packet_queue]:
+            if Q.peek():
+                self.currently_delaying = Q.dequeue()
+                break
+
+    # When the delayed packet is due in milliseconds, its delay counts from when it was queued
+    def release_time(self) -> float:
+        return self.currently_delaying[1] + self.currently_delaying[2][2]
+
+    # Forward or drop the delayed packet once its delay is over, then take the next one, which
+    # may have waited out its delay in the queue already
+    def forward_due(self) -> None:
+        while self.currently_delaying and monotonic() * 1000 >= self.release_time():
+
+            # do not drop end packet, but still delays it
+            if self.check_packet_type(self.currently_delaying[0]) == b"E":
+                self.sock.sendto(
+                    self.currently_delaying[0], self.currently_delaying[2][0])
+
+            else:
+                if random.random()*100 > self.currently_delaying[2][3]:
+                    # forward according to loss_prob
                     self.sock.sendto(
                         self.currently_delaying[0], self.currently_delaying[2][0])
-                
                 else:
-                    if random.random()*100 > self.currently_delaying[2][3]:
-                        # forward according to loss_prob
-                        payload = self.currently_delaying[0][17:]
-                        ty, seq_, win = struct.unpack("!cII",payload[:9])
-                        self.sock.sendto(
-                            self.currently_delaying[0], self.currently_delaying[2][0])
-                    else:
-                        self.log("Loss event occurred", self.currently_delaying[3][0], self.currently_delaying[3][1], self.currently_delaying[
-                                2][0][0], self.currently_delaying[2][0][1], self.currently_delaying[4], self.currently_delaying[5])
-                
-                self.currently_delaying = None
+                    self.log("Loss event occurred", self.currently_delaying[3][0], self.currently_delaying[3][1], self.currently_delaying[
+                            2][0][0], self.currently_delaying[2][0][1], self.currently_delaying[4], self.currently_delaying[5])
+
+            self.currently_delaying = None
+            self.take_next()
 
     def lookup_by_destination(self, destination: Address) -> Union[Table_Entry, None]:
         """Returns the routing table entry that has the given destination address.
@@ -166,29 +176,33 @@ class Emulator:
         If there is no such entry, returns None.
 
         """
-        for e in self.forwarding_table:
-            if destination == e[0]:
-                return e
-        return None
+        return self.routes.get((codec.ip_to_int(destination[0]), destination[1]))
 
     def check_packet_type(self, packet: bytes) -> bytes:
-        payload = packet[17:]
-        packet_type, seq, _ = struct.unpack("!cII", payload[:9])
-        return packet_type
+        return packet[codec.OUTER_SIZE:codec.OUTER_SIZE + 1]
 
     def log(self, message: str, src_addr: str, src_port: int, dest_addr: str, dest_port: int, priority: int, payload_size: int) -> None:
         logging.info("%s\t[src-%s:%d, dst-%s:%d, priority-%d, payload_size-%d]",
                      message, src_addr, src_port, dest_addr, dest_port, priority, payload_size)
 
+    # Event loop: block until a packet arrives or the delayed packet is due, so an idle emulator
+    # uses no CPU. The selector never wakes early, it rounds the timeout up to the next millisecond.
     def start(self) -> None:
-        packet = None
         while 1:
-            try:
-                packet, sender_addr = self.sock.recvfrom(8192)
-            except:
-                pass
-            self.route_packet(packet)
-            packet = None
+            timeout = None
+            if self.currently_delaying:
+                timeout = max(0.0, self.release_time() - monotonic() * 1000) / 1000
+            if self.selector.select(timeout):
+                # read what is there, but no more than a batch before the delayed packet is looked at again
+                for _ in range(RECEIVE_BATCH):
+                    try:
+                        packet, sender_addr = self.sock.recvfrom(8192)
+                    except BlockingIOError:
+                        break
+                    except OSError:
+                        continue
+                    self.route_packet(packet)
+            self.forward_due()
 
 
 if __name__ == "__main__":
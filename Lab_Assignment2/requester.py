@@ -1,28 +1,58 @@
 import argparse
+import shutil
 import socket
 from collections import defaultdict
-from typing import DefaultDict, Tuple, List
-import struct
+from typing import DefaultDict, Dict, Tuple, List
 from typing import Literal
-from datetime import datetime
 import time
-STRUCT_FORMAT = "!cIHIHI"
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import codec
+from common.checkpoint import SUFFIX, Checkpoint, PartState
+from common.pktlog import PacketLog, add_log_arguments, format_time
+from common.reassembly import RangeSet
+from common.timers import TimerQueue
+
+REST_OF_FILE = 1 << 62 # Packet count of a request that runs to the end of the file
+COPY_CHUNK = 1 << 20 # Bytes copied from a spool to the output at a time
+REQUEST_TIMEOUT = 1.0 # Seconds without any packet after which unanswered requests are sent again
+ACK_EVERY = 2 # In-order packets one delayed ACK covers at most
+ACK_DELAY = 10 # Milliseconds an in-order packet waits at most for its ACK
+MAX_WINDOW_FACTOR = 4 # The default --max-window, as a multiple of -w
+WRITE_STALL = 0.02 # Seconds a write to disk may take before the advertised window is halved
 
 class Requester:
     def __init__(self, port: int, filename: str, host_name: str, host_port: int, \
-        window: int) -> None:
+        window: int, pktlog: PacketLog = None, ack_every: int = ACK_EVERY, ack_delay: int = ACK_DELAY,
+        max_window: int = None) -> None:
         self.receive_port = port
         self.UDP_IP = socket.gethostbyname(socket.gethostname())
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((self.UDP_IP, self.receive_port))
+        self.ip = codec.ip_to_int(self.UDP_IP)
         self.filename = filename
         self.host_name = host_name
         self.host_port = host_port
         self.window = window
+        self.max_window = max(window, max_window or MAX_WINDOW_FACTOR * window) # The advertised window never grows past this
+        self.emulator = (socket.gethostbyname(host_name), host_port) # Resolved once, every ACK goes there
+        self.ack_every = max(1, ack_every)
+        self.ack_delay = ack_delay / 1000
+        self.flows: Dict[Tuple[int, int], Flow] = {} # Every sender heard from, by packed address and port
+        self.ack_timers = TimerQueue() # When the delayed ACK of a sender is due
         self.tracker_info = self.read_tracker()
         self.sender_ports = []
+        self.spools: Dict[Tuple[int, int], Spool] = {} # Received packets of every part, by sender
+        self.requests: Dict[Tuple[int, int], Tuple[bytes, Tuple[str, int]]] = {} # Request packet and address, by sender
+        # per-packet events are only recorded while receiving and written out by a background thread
+        self.pktlog = pktlog or PacketLog("summary", formatter=self.format_info)
 
-        self.send_request()
+        try:
+            self.send_request()
+        finally:
+            self.pktlog.close()
 
     def read_tracker(self) -> DefaultDict[str, List[Tuple[int, str, int]]]:
         info = defaultdict(list)
@@ -40,100 +70,168 @@ class Requester:
         return info
 
     def send_request(self) -> None:
+        # the checkpoint records which packets of every part are safely in its spool, a requester
+        # that was interrupted only asks for the packets after the ones it already has. Every part
+        # starts out at the size the output had before, where the assembled file gets appended.
+        # The first part in tracker order is written straight into the output there, the others
+        # wait in spool files until their size, and so their place in the output, is known.
+        checkpoint = Checkpoint(self.filename + SUFFIX, self.sync_spools)
+        if checkpoint.resuming():
+            print(f"[Info] resuming {self.filename} from {checkpoint.path}")
+        base = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+        req_num = 0
         for dest in self.tracker_info[self.filename]:
-            innerheader = struct.pack("!cII", "R".encode(), 0, self.window)
-            send_addr = int.from_bytes(socket.inet_aton(self.UDP_IP), byteorder='big')
-            recv_addr = int.from_bytes(socket.inet_aton(dest[1]), byteorder='big')
-            header = struct.pack(STRUCT_FORMAT, "1".encode(),send_addr, self.receive_port, \
+            part = checkpoint.parts.get(dest[0]) or checkpoint.start_part(dest[0], base)
+            if not self.spools:
+                spool = Spool(self.filename, part.base_offset, dest[0], part, self.max_window)
+            else:
+                spool = Spool(f"{self.filename}.part{dest[0]}", 0, dest[0], part, self.max_window)
+            self.spools[(codec.ip_to_int(dest[1]), dest[2])] = spool
+            if part.complete:
+                continue
+            first = spool.next_seq - 1 # Packets (by index) received in order before the first hole
+            innerheader = codec.pack_inner(codec.REQUEST, 0, self.window)
+            send_addr = self.ip
+            recv_addr = codec.ip_to_int(dest[1])
+            header = codec.pack_outer("1".encode(),send_addr, self.receive_port, \
                         recv_addr,dest[2], len(innerheader))
-            self.sock.sendto(
-                header + innerheader + self.filename.encode(),
-                (
-                    dest[1],
-                    self.host_port
-                ),
-            )
-        self.receive_file(dest[1], dest[2],len(self.tracker_info[self.filename]))
-
-    def receive_file(self, sender_address, sender_port,req_num) -> None:
-        startTime = {}
-        Data_packet_num = {}
-        total_byte = {}
-        log_store =[]
-        summary_store = []
-        file_store = {}
-        file = open(self.filename, "a")
-        request_type = "D"
-        end_num = 0
-        while end_num<req_num:
-            packet, req_addr = self.sock.recvfrom(8192)
-            outterHeader = packet[:17]
-            _, src_addr, src_port, dest_addr, dest_port,_ = struct.unpack(STRUCT_FORMAT, outterHeader)
-            src_addr = socket.inet_ntoa(src_addr.to_bytes(4, byteorder='big'))
-            dest_addr = socket.inet_ntoa(dest_addr.to_bytes(4, byteorder='big'))
-            if dest_addr!= self.UDP_IP:
+            request = header + innerheader + codec.pack_packet_request(self.filename, (first, REST_OF_FILE) if first else None)
+            self.requests[(codec.ip_to_int(dest[1]), dest[2])] = (request, (dest[1], self.host_port))
+            self.sock.sendto(request, (dest[1], self.host_port))
+            req_num += 1
+        self.receive_file(req_num, checkpoint)
+
+        # the rest of the file is only put together once every part is complete, until then the
+        # spools are kept. Whatever an interrupted earlier assembly appended is cut off first.
+        spools = [self.spools[(codec.ip_to_int(dest[1]), dest[2])] for dest in self.tracker_info[self.filename]]
+        head = spools[0]
+        head.close()
+        if checkpoint.all_complete():
+            with open(self.filename, "ab") as file:
+                file.truncate(head.offset + head.size)
+                for spool in spools[1:]:
+                    spool.copy_to(file)
+        else:
+            print(f"[Warning] {self.filename} is still missing packets, run the requester again to fetch them")
+        for spool in spools[1:]:
+            spool.close(remove=checkpoint.all_complete())
+        checkpoint.close(remove=checkpoint.all_complete())
+
+    # Make every spool durable, called by the checkpoint before it records what they hold
+    def sync_spools(self) -> None:
+        for spool in self.spools.values():
+            spool.sync()
+
+    def receive_file(self, req_num: int, checkpoint: Checkpoint) -> None:
+        ended: List[Flow] = [] # Senders in the order their END arrived, a repeated END is only acknowledged again
+        last_heard = time.monotonic()
+        while len(ended)<req_num:
+            # send the delayed ACKs that are due, then wait no longer than until the next one
+            now = time.monotonic()
+            for key in self.ack_timers.pop_expired(now):
+                self.send_ack(self.flows[key])
+            timeout = last_heard + REQUEST_TIMEOUT - now
+            deadline = self.ack_timers.next_deadline()
+            if deadline is not None:
+                timeout = min(timeout, deadline - now)
+            self.sock.settimeout(max(timeout, 0.0001))
+            try:
+                packet, req_addr = self.sock.recvfrom(8192)
+            except TimeoutError:
+                # a request may have been lost on the way, the senders not heard from are asked again
+                if time.monotonic() - last_heard >= REQUEST_TIMEOUT:
+                    last_heard = time.monotonic()
+                    for key, (request, addr) in self.requests.items():
+                        if key not in self.flows:
+                            self.sock.sendto(request, addr)
+                continue
+            last_heard = time.monotonic()
+            outterHeaders, headers, payload = codec.unpack_packet(packet)
+            _, src_ip, src_port, dest_ip, dest_port,_ = outterHeaders
+            if dest_ip != self.ip:
                 print("Received Packet dest addr not consistent with self address, expect ",self.UDP_IP,\
-                    "received" , dest_addr)
+                    "received" , codec.int_to_ip(dest_ip))
             else:
-                if src_addr not in file_store:
-                    file_store[src_addr] = {}
-                    Data_packet_num[src_addr] = {}
-                    total_byte[src_addr] = {}
-                    startTime[src_addr] = {}
-                if src_port not in file_store[src_addr]:
-                    file_store[src_addr][src_port] = {}
-                    Data_packet_num[src_addr][src_port] = 0
-                    total_byte[src_addr][src_port] = 0
-                    startTime[src_addr][src_port] = time.time()
-                outterPayload = packet[17:]
-                header = outterPayload[:9]
-                payload = outterPayload[9:]
-                headers = struct.unpack("!cII", header)
-                request_type, sequence, length, file_content = (
-                    headers[0].decode(),
-                    socket.htonl(headers[1]),
-                    headers[2],
-                    payload,
-                )
-                if Data_packet_num[src_addr][src_port] == 0 and request_type != "D":
+                request_type, sequence, length = headers
+                flow = self.flows.get((src_ip, src_port))
+                if flow is None:
+                    # the headers of every ACK to this sender differ only in their lengths and sequence number
+                    flow = self.flows[(src_ip, src_port)] = Flow((src_ip, src_port), self.spools.get((src_ip, src_port)),
+                        codec.pack_prefix("1".encode(), dest_ip, dest_port, src_ip, src_port), self.window)
+                if flow.packets == 0 and request_type != codec.DATA:
                     print(
-                        f"[Error] first packet recived should be a request with request type 'D', but got {request_type} instead."
+                        f"[Error] first packet recived should be a request with request type 'D', but got {request_type.decode()} instead."
                     )
-                if request_type == "E":
-                    end_num += 1
-                    log_store.append([datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],src_addr, src_port, \
-                                      "E", sequence, length, b""])
-                #send ACK
-                
-                innerheader = struct.pack("!cII", "A".encode(), socket.htonl(sequence), 0)
-                outerheader = struct.pack(STRUCT_FORMAT, "1".encode(),int.from_bytes(socket.inet_aton(dest_addr), byteorder='big'), dest_port, \
-                        int.from_bytes(socket.inet_aton(src_addr), byteorder='big'),src_port, len(innerheader))
-                self.sock.sendto(
-                    outerheader+innerheader, (socket.gethostbyname(self.host_name), self.host_port) 
-                )
-                Data_packet_num[src_addr][src_port] += 1
-                if request_type != "E":
-                    file_store[src_addr][src_port][sequence] = file_content.decode()   
-                    total_byte[src_addr][src_port] += length
+                spool = flow.spool
+                repeated = request_type == codec.END and flow.ended
+                if request_type == codec.END and not repeated:
+                    flow.ended = True
+                    ended.append(flow)
+                    self.log_info(flow.addr, flow.port, "E", sequence, length, b"")
+                    if spool is not None:
+                        # the END follows the last packet, so the part has sequence - 1 packets
+                        checkpoint.set_size(spool.part_id, sequence - 1)
+                        if not checkpoint.parts[spool.part_id].ranges.missing(sequence - 1):
+                            checkpoint.complete(spool.part_id)
+                in_order = False
+                if request_type != codec.END and spool is not None:
+                    # only the packets written out in order are recorded, the ones ahead of a hole
+                    # are fetched again should the requester be interrupted
+                    first, end = spool.add(sequence, payload)
+                    if end > first:
+                        checkpoint.add(spool.part_id, first - 1, end - 1, spool.size)
+                    in_order = sequence == first and end == first + 1 and not spool.pending
+                    flow.update_window(end - first, spool.take_stall(), self.max_window, spool.max_ahead - len(spool.pending))
+                #send ACK, delayed while packets arrive in order, at once for a hole, a duplicate or the END
+                flow.seq = sequence
+                if in_order:
+                    self.delay_ack(flow)
+                else:
+                    self.send_ack(flow)
+                if repeated:
+                    continue
+                flow.packets += 1
+                if request_type != codec.END:
+                    flow.bytes += length
+                    self.log_info(flow.addr, flow.port, "D", sequence, length, payload)
                 else:
-                    log_store.append([datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],src_addr, src_port, \
-                                      "D", sequence, length, file_content])
-                    duration =  int((time.time() - startTime[src_addr][src_port]) * 1000)
-                    summary_store.append([src_addr, src_port,Data_packet_num[src_addr][src_port],total_byte[src_addr][src_port],\
-                                   duration,round(Data_packet_num[src_addr][src_port] / (duration / 1000))])
+                    flow.duration = int((time.time() - flow.start) * 1000)
 
-        for dest in self.tracker_info[self.filename]:
-            store = file_store[dest[1]][dest[2]]       
-            file_index = sorted(store.keys())
-            for i in file_index:
-                file.write(store[i])
-        file.close()
-        for loginfo in summary_store:
-            self.log_Summary(loginfo[0],loginfo[1],loginfo[2],loginfo[3],loginfo[4],loginfo[5])
+        self.pktlog.flush()
+        for flow in ended:
+            self.log_Summary(flow.addr, flow.port, flow.packets, flow.bytes, flow.duration,
+                             round(flow.packets / (max(flow.duration, 1) / 1000)), flow.sent)
+
+    # Count an in-order packet towards the delayed ACK of its sender, a sender never waits on
+    # ACKs for more packets than its window
+    def delay_ack(self, ack: "Flow") -> None:
+        ack.waiting += 1
+        if ack.waiting >= min(self.ack_every, ack.window):
+            self.send_ack(ack)
+        elif ack.waiting == 1:
+            self.ack_timers.arm(ack.key, time.monotonic() + self.ack_delay)
+
+    # ACK the last packet of a sender, with the cumulative ACK and SACK blocks of everything its
+    # part received so far and the window it may use now
+    def send_ack(self, ack: "Flow") -> None:
+        payload = self.ack_payload(ack.spool.received, ack.seq, ack.window) if ack.spool is not None else b""
+        self.sock.sendto(ack.prefix + codec.pack_tail(codec.ACK, ack.seq, len(payload)) + payload, self.emulator)
+        ack.sent += 1
+        if ack.waiting:
+            ack.waiting = 0
+            self.ack_timers.cancel(ack.key)
+
+    # ACK payload of a part: the cumulative ACK, the window and the SACK blocks above it in sequence
+    # numbers, the block holding the packet that triggered the ACK first. The ranges are packet
+    # indices, sequence number n is index n - 1.
+    def ack_payload(self, ranges: RangeSet, sequence: int, window: int) -> bytes:
+        cumulative = ranges.contiguous() + 1
+        blocks = [(start + 1, end + 1) for start, end in ranges if start + 1 > cumulative]
+        blocks.sort(key=lambda block: not block[0] <= sequence < block[1])
+        return codec.pack_ack(cumulative, blocks, window)
 
     def log_info(
         self,
-        recv_time: str,
         sender_address: str,
         sender_port: str,
         type: Literal["D", "E"],
@@ -141,22 +239,25 @@ class Requester:
         length: int,
         payload: bytes,
     ) -> None:
+        self.pktlog.record(type, seq, length, payload, (sender_address, sender_port))
+
+    @staticmethod
+    def format_info(type: str, recv_time: float, seq: int, length: int, sender: Tuple[str, int], payload: bytes) -> str:
         if type == "D":
-            print(f"-----DATA Packet-----")
-            print(f"recv time: {recv_time}")
-            print(f"sender addr: {sender_address}: {sender_port}")
-            print(f"Sequence num: {seq}")
-            print(f"length:: {length}")
-            print(f"payload: {payload[:4].decode()}")
-            print(f"---------------------")
-        elif type == "E":
-            print(f"-----END Packet------")
-            print(f"recv time: {recv_time}")
-            print(f"sender addr: {sender_address}: {sender_port}")
-            print(f"Sequence num: {seq}")
-            print(f"length:: {length}")
-            print(f"payload: {payload.decode()}")
-            print(f"---------------------")
+            return (f"-----DATA Packet-----\n"
+                    f"recv time: {format_time(recv_time)}\n"
+                    f"sender addr: {sender[0]}: {sender[1]}\n"
+                    f"Sequence num: {seq}\n"
+                    f"length:: {length}\n"
+                    f"payload: {payload.decode(errors='replace')}\n"
+                    f"---------------------\n")
+        return (f"-----END Packet------\n"
+                f"recv time: {format_time(recv_time)}\n"
+                f"sender addr: {sender[0]}: {sender[1]}\n"
+                f"Sequence num: {seq}\n"
+                f"length:: {length}\n"
+                f"payload: {payload.decode(errors='replace')}\n"
+                f"---------------------\n")
 
     def log_Summary(
         self,
@@ -166,13 +267,131 @@ class Requester:
         total_byte: int,
         duration: int,
         avg_packet: int,
+        acks_sent: int,
     ) -> None:
+        if not self.pktlog.summaries():
+            return
         print("Summary")
         print(f"Sender Address: {sender_address}:{sender_port}")
         print(f"Total Data Packets: {Data_packet_num}")
         print(f"total Data Bytes: {total_byte}")
         print(f"Average Packets/Second: {avg_packet}")
         print(f"Duration of The Test: {duration}ms")
+        print(f"ACKs Sent: {acks_sent}")
+
+
+# Everything the requester keeps of one sender: its part, counters, delayed ACK and advertised
+# window. Slots keep the object small and its attributes quick to reach, it is looked up once
+# per packet by the packed address and port from the header.
+class Flow:
+    __slots__ = ("key", "addr", "port", "spool", "prefix", "seq", "waiting", "sent", "limit", "window",
+                 "packets", "bytes", "start", "duration", "ended")
+
+    def __init__(self, key: Tuple[int, int], spool: "Spool", prefix: bytes, window: int) -> None:
+        self.key = key # Packed address and port
+        self.addr = codec.int_to_ip(key[0]) # Dotted address, for the log and the summary
+        self.port = key[1]
+        self.spool = spool # The part the sender sends, None for a sender not in the tracker
+        self.prefix = prefix # Emulator header of the ACKs up to their length
+        self.seq = 0 # Sequence number of the last packet received
+        self.waiting = 0 # In-order packets received since the last ACK
+        self.sent = 0 # ACKs sent
+        self.limit = float(window) # Largest window while writes keep up, grows and shrinks with them
+        self.window = window # Packets the sender may have in flight past the cumulative ACK
+        self.packets = 0 # Packets received, the END and duplicates included
+        self.bytes = 0 # Payload bytes received
+        self.start = time.time()
+        self.duration = 0 # Milliseconds from the first packet to the END
+        self.ended = False
+
+    # The window is the room the spool has left for packets ahead of a hole, so the sender never
+    # sends what would be dropped, but at least 1 so it can always fill the hole. While packets
+    # are written out without trouble the limit on it grows by about one packet for every window
+    # of them, up to max_window. A write that stalled halves the limit: whatever the sender has in
+    # flight meanwhile piles up in the socket buffer and is dropped once it is full.
+    def update_window(self, written: int, stall: float, max_window: int, free: int) -> None:
+        if stall > WRITE_STALL:
+            self.limit = max(1.0, self.limit / 2)
+        elif written:
+            self.limit = min(float(max_window), self.limit + written / self.limit)
+        self.window = max(1, min(int(self.limit), free))
+
+
+# The payloads of one part, appended in sequence order to a file at offset as soon as they are
+# contiguous, so that an interrupted transfer keeps them. Packets that arrive ahead of a hole
+# wait in memory until it is filled. A sender never has more than the largest advertised
+# window past the hole, anything further ahead is dropped, so no more than that many packets
+# wait per sender. The file holds nothing but the payloads, so a spool that is not the output
+# itself is copied out in large chunks at the end.
+class Spool:
+    def __init__(self, path: str, offset: int, part_id: int, part: PartState, max_ahead: int) -> None:
+        self.path = path
+        self.offset = offset # Where the part starts in the file
+        self.part_id = part_id
+        self.max_ahead = max_ahead # Packets past next_seq that are kept, the largest window the requester advertises
+        self.next_seq = 1 # First sequence number not written out yet
+        self.pending: Dict[int, bytes] = {} # Payloads received ahead of next_seq, by sequence number
+        self.size = 0 # Bytes of the part written out
+        self.stall = 0.0 # Longest a write or sync took since the requester last asked
+        self.load(part)
+        self.received = RangeSet() # Packet indices received so far, written out or pending
+        if self.next_seq > 1:
+            self.received.add(0, self.next_seq - 1)
+        self.file = open(path, "ab")
+
+    # Find where an earlier run stopped. Only the packets the checkpoint recorded are trusted,
+    # the spool is synced before the checkpoint is written, anything past them is cut off.
+    def load(self, part: PartState) -> None:
+        on_disk = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if part.written and on_disk >= self.offset + part.written:
+            self.next_seq = part.ranges.contiguous() + 1
+            self.size = part.written
+        if on_disk != self.offset + self.size:
+            with open(self.path, "ab") as f:
+                f.truncate(self.offset + self.size)
+
+    # Take a payload and write out the run of packets it completes, returns the sequence
+    # numbers [first, end) written, an empty run if it waits for a hole, was a duplicate or
+    # was too far ahead. A packet too far ahead is not kept, so it is not acknowledged either.
+    def add(self, seq: int, payload: bytes) -> Tuple[int, int]:
+        first = self.next_seq
+        if seq < first or seq >= first + self.max_ahead or seq in self.pending:
+            return first, first
+        self.pending[seq] = bytes(payload)
+        self.received.add(seq - 1, seq)
+        if self.next_seq not in self.pending:
+            return first, first
+        start = time.perf_counter()
+        while self.next_seq in self.pending:
+            payload = self.pending.pop(self.next_seq)
+            self.file.write(payload)
+            self.size += len(payload)
+            self.next_seq += 1
+        self.stall = max(self.stall, time.perf_counter() - start)
+        return first, self.next_seq
+
+    def sync(self) -> None:
+        start = time.perf_counter()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.stall = max(self.stall, time.perf_counter() - start)
+
+    # The longest write or sync since the last call
+    def take_stall(self) -> float:
+        stall, self.stall = self.stall, 0.0
+        return stall
+
+    # Append the part to file, the spool holds its payloads in order already
+    def copy_to(self, file) -> None:
+        self.file.flush()
+        with open(self.path, "rb") as f:
+            shutil.copyfileobj(f, file, COPY_CHUNK)
+
+    def close(self, remove: bool = False) -> None:
+        if not self.file.closed:
+            self.file.close()
+        if remove:
+            os.remove(self.path)
 
 
 if __name__ == "__main__":
@@ -208,5 +427,24 @@ if __name__ == "__main__":
         type=int,
         required=True,
     )
+    parser.add_argument(
+        "--ack-every",
+        help="in-order packets acknowledged by one ACK, 1 acknowledges every packet",
+        type=int,
+        default=ACK_EVERY,
+    )
+    parser.add_argument(
+        "--ack-delay",
+        help="milliseconds an in-order packet waits at most for its ACK",
+        type=int,
+        default=ACK_DELAY,
+    )
+    parser.add_argument(
+        "--max-window",
+        help=f"largest window the requester advertises while it keeps up with writing, defaults to {MAX_WINDOW_FACTOR} times -w",
+        type=int,
+    )
+    add_log_arguments(parser, "summary")
     args = parser.parse_args()
-    requester = Requester(args.p, args.o, args.f, args.e, args.w)
\ No newline at end of file
+    pktlog = PacketLog(args.log_level, args.log_format, args.log_file, Requester.format_info, args.log_sample)
+    requester = Requester(args.p, args.o, args.f, args.e, args.w, pktlog, args.ack_every, args.ack_delay, args.max_window)
\ No newline at end of file
@@ -1,242 +1,360 @@
 import argparse
 import socket
-import struct
-import math
+import os
+import selectors
+import sys
 import time
-from typing import Literal
-from datetime import datetime
-STRUCT_FORMAT = "!cIHIHI"
+from collections import OrderedDict
+from typing import Dict, List, Literal, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.pacer import Pacer
+from common.batch import BatchSender
+from common import codec
+from common.pktlog import PacketLog, add_log_arguments, format_time
+from common.rtt import RttEstimator
+from common.congestion import ALGORITHMS
+from common.timers import TimerQueue
+from common.reassembly import RangeSet
+
+MAX_RETRANSMITS = 5 # A packet is given up on when its timer runs out after this many retransmissions on timeout
+REORDER_THRESHOLD = 3 # A packet is taken as lost once one sent this many transmissions after it was acknowledged
 
 class Sender:
     def __init__(
         self, port: int, req_port: int, rate: int, seq_no: int, length: int,  \
-            host_name: str, host_port: int, priority: str, timeout:int 
+            host_name: str, host_port: int, priority: str, timeout:int, burst: int = 1, pktlog: PacketLog = None, congestion: str = "none",
+            reorder: int = REORDER_THRESHOLD
     ) -> None:
         self. total_packet_sent = 0
         self.total_retransmit = 0
+        self.total_fast_retransmit = 0
+        self.reorder = reorder # Packets that may overtake a packet before it is resent without waiting for its timer
         self.listen_port = port
         self.requester_port = req_port
         self.requester_address = None
         self.rate = rate
+        self.pacer = Pacer(rate, burst)
         self.sequence_no = 1
         self.length = length
         self.UDP_IP = socket.gethostbyname(socket.gethostname())
         self.priority = priority
         self.host_name = host_name
         self.host_port = host_port
+        self.emulator = (socket.gethostbyname(host_name), host_port) # Resolved once, every packet goes there
         self.timeout = float(timeout)/1000
+        self.rtt = RttEstimator(self.timeout) # -t is both the initial and the smallest retransmission timeout
+        self.cc = ALGORITHMS[congestion]() # Limits the packets in flight below the requester's window
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((self.UDP_IP, self.listen_port))
-        self.listen_to_request()
+        self.batch = BatchSender(self.sock)
+        # the transfer loop waits on the selector until the next deadline instead of setting socket timeouts
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        # per-packet events are only recorded while sending and written out by a background thread
+        self.pktlog = pktlog or PacketLog("summary")
+        self.pktlog.formatter = self.format_info
+        try:
+            self.listen_to_request()
+        finally:
+            self.pktlog.close()
 
     def listen_to_request(self) -> None:
         packet, req_addr = self.sock.recvfrom(8192)
         self.requester_address = req_addr[0]
-        outterHeader = packet[:17]
-        outterPayload = packet[17:]
-        header = outterPayload[:9]
-        payload = outterPayload[9:]
-        headers = struct.unpack("!cII", header)
-        outterHeaders = struct.unpack(STRUCT_FORMAT, outterHeader)
+        outterHeaders, headers, payload = codec.unpack_packet(packet)
+        # addresses stay packed ints, they are only copied into the headers of the reply
         _, src_addr, src_port, dest_addr, dest_port,_ = outterHeaders
-        src_addr = socket.inet_ntoa(src_addr.to_bytes(4, byteorder='big'))
-        dest_addr = socket.inet_ntoa(dest_addr.to_bytes(4, byteorder='big'))
-        request_type, file_requested, window_size = headers[0].decode(), payload.decode(),headers[2]
+        request_type, window_size = headers[0].decode(), headers[2]
+        # a requester resuming an interrupted transfer asks only for the packets from some index on
+        file_requested, packet_range = codec.unpack_packet_request(payload)
         if request_type != "R":
             print(
                 f"[Error] Should get a request with request type 'R', but got {request_type} instead."
             )
-        self.send_file(file_requested, src_addr, src_port, dest_addr, dest_port, window_size)
+        self.send_file(file_requested, src_addr, src_port, dest_addr, dest_port, window_size, packet_range)
 
 
     def send_file(self, filename: str, src_addr: int, src_port: int, \
-        dest_addr: int, dest_port: int, window_size:int) -> None:
+        dest_addr: int, dest_port: int, window_size:int, packet_range: Tuple[int, int] = None) -> None:
         # read in the requested file
         content = b""
         with open(filename, "r") as f:
             content = f.read().encode()
-        filesize = len(content)
-
-        headers = []
-        sequence_nos = []
-        innerheaders = []
-        send_addr = int.from_bytes(socket.inet_aton(dest_addr), byteorder='big')
-        recv_addr = int.from_bytes(socket.inet_aton(src_addr), byteorder='big')
-        self.priority = str(self.priority)
-        if filesize <= self.length:
-            innerheader = struct.pack(
-                    "!cII", "D".encode(), socket.htonl(self.sequence_no), filesize)
-            # not sure if it's the correct way to pack outter header
-            headers.append(
-                    struct.pack(STRUCT_FORMAT, self.priority.encode(),send_addr, dest_port, \
-                        recv_addr,src_port, len(innerheader)+filesize)
-            )
-            sequence_nos.append(self.sequence_no)
-            innerheaders.append(innerheader)
-            self.sequence_no += 1
-        else:
-            num_packets = math.ceil(filesize / self.length)
-            last_payload_length = filesize % self.length
-            for i in range(num_packets):
-                if i == num_packets - 1:
-                    # last packet
-                    if last_payload_length == 0:
-                        last_payload_length = 10
-                    innerheader = struct.pack(
-                            "!cII", "D".encode(), socket.htonl(self.sequence_no), last_payload_length)
-                    headers.append(
-                        struct.pack(STRUCT_FORMAT, self.priority.encode(),send_addr, dest_port, \
-                            recv_addr,src_port, len(innerheader)+last_payload_length)
-                    )
-                    sequence_nos.append(self.sequence_no)
-                    self.sequence_no += 1
-                    innerheaders.append(innerheader)
-                else:
-                    innerheader = struct.pack(
-                            "!cII", "D".encode(), socket.htonl(self.sequence_no), self.length)
-                    headers.append(
-                        struct.pack(STRUCT_FORMAT, self.priority.encode(),send_addr, dest_port, \
-                            recv_addr,src_port, len(innerheader)+self.length)
-                    )
-                    sequence_nos.append(self.sequence_no)
-                    self.sequence_no += 1
-                    innerheaders.append(innerheader)
-
-        file_parts = []
-        for i in range(len(headers)):
-            file_parts.append(content[i * self.length : (i + 1) * self.length])
-        
+
+        # every DATA packet is packed once into one buffer, sending only hands out slices of it
+        priority = str(self.priority).encode()
+        buffer, slices = pack_packets(content, self.length, self.sequence_no, priority, dest_addr, dest_port, src_addr, src_port)
+        self.sequence_no += len(slices)
+
         # add End packet 
-        finalInner = struct.pack("!cII", "E".encode(), socket.htonl(self.sequence_no), 0)
-        finalHeader = struct.pack(STRUCT_FORMAT, self.priority.encode(),send_addr, dest_port, \
-                            recv_addr,src_port, len(innerheader))
-        header_and_payload = [
-            header + innerheader + payload for header, innerheader, payload in zip(headers, innerheaders,file_parts)
-        ]
-        
-        index = 0
-        window_num = 0
-        # send the packets with rate limit
-        dest = socket.gethostbyname(self.host_name)
-        while index < len(header_and_payload):
-            # send a full window or remaining packets
-            window = min(window_size, len(header_and_payload) - window_size * window_num)
-            #print("index ",index, "length: ",len(header_and_payload), "window: ", window, window_num,window_size)
-            if window <0:
-                raise RuntimeError()
-            for i in range(window):
-                outterHeader = header_and_payload[index][:17]
-                outterPayload = header_and_payload[index][17:]
-                header = outterPayload[:9]
-                payload = outterPayload[9:]
-                headers = struct.unpack("!cII", header)
-                outterHeaders = struct.unpack(STRUCT_FORMAT, outterHeader)
-                pri, src_addr, src_port, dest_addr, dest_port,leng = outterHeaders
-                src_addr = socket.inet_ntoa(src_addr.to_bytes(4, byteorder='big'))
-                dest_addr = socket.inet_ntoa(dest_addr.to_bytes(4, byteorder='big'))
-                request_type, sq_n, window_size1 = headers
-                payload = payload.decode()
-                self.sock.sendto(
-                    #requester and emulator should all use same address, it should work for this project?
-                    header_and_payload[index], (socket.gethostbyname(self.host_name), self.host_port) 
-                )
-                index += 1
-                self.total_packet_sent += 1
-                time.sleep(1 / self.rate)
-            
-            window_num += 1
-            # try to receive all returning ack packets
-            received_ack = []
-            for i in range(window):
-                try:
-                    self.sock.settimeout(self.timeout)
-                    packet, _ = self.sock.recvfrom(8192)
-                    self.sock.settimeout(None)
-                    outterPayload = packet[17:]
-                    header = outterPayload[:9]
-                    headers = struct.unpack("!cII", header)
-                    request_type, seq_no,_ = headers
-                    request_type = request_type.decode()
-                    seq_no = socket.htonl(seq_no)
-                    #get all ack packets seq_no
-                    if request_type == "A":
-                        received_ack.append(seq_no -1)
-                except TimeoutError:
-                    print("Timeout for one of the packet.")
-            # if there are missing packets, try to resend all missing packets
-            if len(received_ack) != window:
-                missing =  [i for i in range(index-window,index) if i not in received_ack]
-                for i in missing:
-                    trial = 1
-                    self.sock.sendto(
-                        header_and_payload[i], (socket.gethostbyname(self.host_name), self.host_port)
+        finalInner = codec.pack_inner(codec.END, self.sequence_no, 0)
+        finalHeader = codec.pack_outer(priority, dest_addr, dest_port, src_addr, src_port, codec.INNER_SIZE)
+        # only the requested packets are sent, skip maps their indices back to sequence numbers
+        skip = 0
+        if packet_range is not None:
+            skip = min(packet_range[0], len(slices))
+            slices = slices[skip:skip + packet_range[1]]
+
+        self.send_window(buffer, slices, skip, window_size, self.emulator)
+
+        # send END packet, again until it is acknowledged since the requester waits for it
+        for trial in range(MAX_RETRANSMITS + 1):
+            self.sock.sendto(finalHeader+finalInner, self.emulator)
+            self.log_info("E", self.sequence_no, 0, b"")
+            if self.wait_for_ack(self.sequence_no, time.monotonic() + self.rtt.timeout(trial)):
+                break
+            self.rtt.timed_out()
+        self.pktlog.flush()
+        if not self.pktlog.summaries():
+            return
+        print(f"Packets Sent: {self.total_packet_sent}, retransmitted: {self.total_retransmit} ({self.total_fast_retransmit} fast)")
+        print(f"Loss Rate: {self.total_retransmit/max(self.total_packet_sent, 1) * 100}%")
+        print(f"Achieved Rate: {round(self.pacer.achieved_rate())} packets/second")
+        for line in self.rtt.stats() + self.cc.stats():
+            print(line)
+
+    # Selective repeat: up to window_size packets are in flight, each with its own retransmission
+    # timer. New packets go out as soon as the left edge of the window moves, and ACKs are taken
+    # in any order, so the pipe never drains at a window boundary. The requester may advertise
+    # a new window in every ACK, and the congestion window may keep fewer packets in flight.
+    def send_window(self, buffer: bytearray, slices: List[Tuple[int, int]], skip: int, window_size: int, dest: Tuple[str, int]) -> None:
+        count = len(slices)
+        view = memoryview(buffer)
+        log_packets = self.pktlog.enabled() # Payload views are only made for the log when it records them
+        window_size = max(1, window_size)
+        self.cc.max_window = window_size
+        board = Scoreboard(count)
+        next_index = 0 # First packet never sent
+        while board.base < count:
+            # fill the window with new packets, as many at a time as the pacer lets through
+            limit = min(board.base + window_size, count, next_index + self.cc.window() - board.in_flight())
+            if next_index < limit:
+                sent = self.pacer.take(limit - next_index)
+                if sent == 1:
+                    # one packet gains nothing from sendmmsg, sendto on a view of it is cheaper
+                    offset, length = slices[next_index]
+                    self.sock.sendto(view[offset:offset + length], dest)
+                else:
+                    self.batch.send_slices(buffer, slices[next_index:next_index + sent], dest)
+                now = time.monotonic()
+                deadline = now + self.rtt.timeout()
+                for i in range(next_index, next_index + sent):
+                    board.sent(i, now, deadline)
+                if log_packets:
+                    for i in range(next_index, next_index + sent):
+                        self.log_packet(view, slices[i], skip + i + 1)
+                next_index += sent
+                self.total_packet_sent += sent
+
+            # retransmit every packet whose timer ran out
+            now = time.monotonic()
+            for i in board.timers.pop_expired(now):
+                print("Timeout for one of the packet.")
+                self.rtt.timed_out()
+                self.cc.on_loss(i, next_index)
+                board.timeouts[i] = board.timeouts.get(i, 0) + 1
+                if board.timeouts[i] > MAX_RETRANSMITS:
+                    print(f"Gave up on packet {skip+i+1}, moving on to next packet")
+                    board.ack(i)
+                    continue
+                self.retransmit(board, i, view, slices[i], skip, dest)
+
+            # wait for ACKs until the next timer runs out, or only take what is already there
+            # while the window has room for new packets
+            if next_index >= min(board.base + window_size, count, next_index + self.cc.window() - board.in_flight()) and board.in_flight():
+                self.selector.select(max(0.0, board.timers.next_deadline() - time.monotonic()))
+            for packet in self.pending_packets():
+                request_type, seq_no, length = codec.unpack_inner(packet, codec.OUTER_SIZE)
+                if request_type != codec.ACK:
+                    print(
+                        f"[Error] Should get a ack packet with request type 'A', but got {request_type.decode()} instead."
                     )
-                    self.total_retransmit +=1
-                    self.total_packet_sent +=1
-                    ack = False
-                    while trial <=5 and ack == False:
-                        try:
-                            self.sock.settimeout(self.timeout)
-                            packet, _ = self.sock.recvfrom(8192)
-                            self.sock.settimeout(None)
-                            outterPayload = packet[17:]
-                            header = outterPayload[:9]
-                            headers = struct.unpack("!cII", header)
-                            request_type, seq_no,_ = headers
-                            request_type = request_type.decode()
-                            seq_no = socket.htonl(seq_no)
-                            if request_type != "A":
-                                print(
-                                    f"[Error] Should get a ack packet with request type 'A', but got {request_type} instead."
-                                    )
-                            elif seq_no != i+1:
-                                print(
-                                    f"[Error] Wrong sequnence number in ack packet, should be {i+1}, but got {seq_no} instead."
-                                    )
-                            else:
-                                ack = True
-                        except TimeoutError:
-                            if trial < 5:
-                                self.sock.sendto(
-                                    header_and_payload[i], (socket.gethostbyname(self.host_name), self.host_port)
-                                )
-                                time.sleep(1 / self.rate)
-                                self.total_retransmit +=1
-                                self.total_packet_sent +=1
-                                trial +=1
-                            else:
-                                trial += 1
-                    
-                    if(trial > 5 and ack == False):
-                        print(f"Gave up on packet {i+1}, moving on to next packet")
-
-        # send END packet
-        self.sock.sendto(
-                    #requester and emulator should all use same address, it should work for this project?
-                    finalHeader+finalInner, (socket.gethostbyname(self.host_name), self.host_port) 
-                )
-        
-        print(f"Loss Rate: {self.total_retransmit/self.total_packet_sent * 100}%")
+                    continue
+                # Karn's rule: the ACK of a retransmitted packet may belong to any of its copies,
+                # and only the packet that triggered the ACK has a meaningful RTT
+                i = seq_no - 1 - skip
+                rtt = board.rtt_sample(i, time.monotonic())
+                if rtt is not None:
+                    self.rtt.sample(rtt)
+                newly_acked = board.ack(i)
+                # the cumulative ACK and SACK blocks also cover packets whose own ACK was lost
+                cumulative, blocks, window = codec.unpack_ack(packet[codec.HEADER_SIZE:codec.HEADER_SIZE + length])
+                if window is not None:
+                    # the requester moves its window while the transfer runs, it counts from the left edge like the first one
+                    window_size = max(1, window)
+                    self.cc.max_window = window_size
+                if cumulative is not None:
+                    newly_acked += board.ack_range(0, cumulative - 1 - skip)
+                    for start, end in blocks:
+                        newly_acked += board.ack_range(start - 1 - skip, end - 1 - skip)
+                for n in range(newly_acked):
+                    self.cc.on_ack(rtt if n == 0 else None)
+            board.advance()
+
+            # fast retransmit: a packet overtaken by reorder later ones is resent without waiting for its timer
+            for i in board.lost(self.reorder) if self.reorder > 0 else []:
+                self.cc.on_loss(i, next_index, timeout=False)
+                self.retransmit(board, i, view, slices[i], skip, dest)
+                self.total_fast_retransmit += 1
+
+    def retransmit(self, board: "Scoreboard", i: int, view: memoryview, packet: Tuple[int, int], skip: int, dest: Tuple[str, int]) -> None:
+        offset, length = packet
+        self.pacer.wait()
+        self.sock.sendto(view[offset:offset + length], dest)
+        self.log_packet(view, packet, skip + i + 1)
+        board.retransmitted(i, time.monotonic() + self.rtt.timeout(board.timeouts.get(i, 0)))
+        self.total_retransmit += 1
+        self.total_packet_sent += 1
+
+    # Wait until seq_no is acknowledged or the deadline passes, ACKs for other packets are dropped
+    def wait_for_ack(self, seq_no: int, deadline: float) -> bool:
+        while True:
+            for packet in self.pending_packets():
+                request_type, ack_no, _ = codec.unpack_inner(packet, codec.OUTER_SIZE)
+                if request_type == codec.ACK and ack_no == seq_no:
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.selector.select(remaining)
+
+    # The packets already waiting on the socket, read without blocking
+    def pending_packets(self):
+        while True:
+            try:
+                packet, _ = self.sock.recvfrom(8192, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return
+            yield packet
+
+    # Log the DATA packet at the (offset, length) slice of the packet buffer
+    def log_packet(self, view: memoryview, packet: Tuple[int, int], seq: int) -> None:
+        offset, length = packet
+        self.log_info("D", seq, length - codec.HEADER_SIZE, view[offset + codec.HEADER_SIZE:offset + length])
 
     def log_info(self, type: Literal["D", "E"], seq: int, length: int, payload: bytes) -> None:
+        self.pktlog.record(type, seq, length, payload, (self.requester_address, self.requester_port))
+
+    def format_info(self, type: str, when: float, seq: int, length: int, requester: Tuple[str, int], payload: bytes) -> str:
         if type == "D":
-            print(f"-----DATA Packet-----")
-            print(f"Send Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
-            print(f"Requester Address: {self.requester_address}: {self.requester_port}")
-            print(f"Sequence number: {seq}")
-            print(f"Length: {length}")
-            print(f"Payload: {payload[:4].decode()}")
-            print(f"---------------------")
-        elif type == "E":
-            print(f"-----END Packet------")
-            print(f"send time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
-            print(f"requester addr: {self.requester_address}: {self.requester_port}")
-            print(f"Sequence num: {seq}")
-            print(f"payload: {payload.decode()}")
-            print(f"total packet sent: {self.total_packet_sent}")
-            print(f"total retransmit: {self.total_retransmit}")
-            print(f"loss rate:{self.total_retransmit/self.total_packet_sent * 100} %")
-            print(f"---------------------")
+            return (f"-----DATA Packet-----\n"
+                    f"Send Time: {format_time(when)}\n"
+                    f"Requester Address: {requester[0]}: {requester[1]}\n"
+                    f"Sequence number: {seq}\n"
+                    f"Length: {length}\n"
+                    f"Payload: {payload.decode(errors='replace')}\n"
+                    f"---------------------\n")
+        return (f"-----END Packet------\n"
+                f"send time: {format_time(when)}\n"
+                f"requester addr: {requester[0]}: {requester[1]}\n"
+                f"Sequence num: {seq}\n"
+                f"payload: {payload.decode(errors='replace')}\n"
+                f"total packet sent: {self.total_packet_sent}\n"
+                f"total retransmit: {self.total_retransmit}\n"
+                f"loss rate:{self.total_retransmit/max(self.total_packet_sent, 1) * 100} %\n"
+                f"---------------------\n")
+
+
+# Pack every DATA packet of content once into one buffer, returns it with the (offset, length)
+# of every packet inside it. Only the last packet may have a shorter payload.
+def pack_packets(content: bytes, length: int, seq_no: int, priority: bytes, src_addr: int, src_port: int,
+                 dest_addr: int, dest_port: int) -> Tuple[bytearray, List[Tuple[int, int]]]:
+    count = max(1, -(-len(content) // length)) # An empty file is still one empty packet
+    stride = codec.HEADER_SIZE + length
+    buffer = bytearray(count * stride)
+    content = memoryview(content)
+    slices = []
+    for i in range(count):
+        payload = content[i * length:(i + 1) * length]
+        offset = i * stride
+        codec.pack_header_into(buffer, offset, priority, src_addr, src_port, dest_addr, dest_port, codec.DATA, seq_no + i, len(payload))
+        buffer[offset + codec.HEADER_SIZE:offset + codec.HEADER_SIZE + len(payload)] = payload
+        slices.append((offset, codec.HEADER_SIZE + len(payload)))
+    return buffer, slices
+
+
+# What the sender knows about every packet of a transfer: which ones were acknowledged, and
+# when each packet in flight was sent and times out
+class Scoreboard:
+    def __init__(self, count: int) -> None:
+        self.count = count
+        self.acked = bytearray(count) # Whether every packet was acknowledged (or given up on)
+        self.acked_ranges = RangeSet() # The same as runs of indices, so a SACK block that was applied before is skipped at once
+        self.timers = TimerQueue() # Retransmission deadline of every packet in flight, by index
+        self.retransmits: Dict[int, int] = {} # Times every packet in flight was retransmitted
+        self.timeouts: Dict[int, int] = {} # Times the timer of every packet in flight ran out, its timeout doubles with each
+        self.sent_at: Dict[int, float] = {} # When every packet in flight was first sent, for RTT samples
+        self.base = 0 # First packet not acknowledged yet, the left edge of the window
+        self.transmissions = 0 # Numbers every transmission, first sends and retransmissions alike
+        # Number of the last transmission of every packet in flight, kept in transmission order
+        self.sent_as: "OrderedDict[int, int]" = OrderedDict()
+        self.highest_acked = -1 # Latest transmission that was acknowledged
+        self.checked = -1 # highest_acked when lost() last looked
+
+    def in_flight(self) -> int:
+        return len(self.timers)
+
+    def sent(self, i: int, now: float, deadline: float) -> None:
+        self.timers.arm(i, deadline)
+        self.sent_at[i] = now
+        self.sent_as[i] = self.transmissions
+        self.transmissions += 1
+
+    def retransmitted(self, i: int, deadline: float) -> None:
+        self.retransmits[i] = self.retransmits.get(i, 0) + 1
+        self.timers.arm(i, deadline)
+        self.sent_as[i] = self.transmissions
+        self.sent_as.move_to_end(i)
+        self.transmissions += 1
+
+    # Packets in flight whose last transmission was overtaken by at least threshold later
+    # transmissions that were acknowledged, only looked for when a later one was acknowledged.
+    # Only the oldest transmissions are looked at, up to the first one that is recent enough.
+    def lost(self, threshold: int) -> List[int]:
+        if self.highest_acked == self.checked:
+            return []
+        self.checked = self.highest_acked
+        limit = self.highest_acked - threshold
+        lost = []
+        for i, n in self.sent_as.items():
+            if n > limit:
+                break
+            lost.append(i)
+        return lost
+
+    # RTT of packet i if it is still in flight and was only sent once
+    def rtt_sample(self, i: int, now: float) -> Optional[float]:
+        if 0 <= i < self.count and not self.acked[i] and i not in self.retransmits:
+            return now - self.sent_at[i]
+        return None
+
+    # Mark packet i acknowledged, returns 1 if it was not yet
+    def ack(self, i: int) -> int:
+        if not 0 <= i < self.count or self.acked[i]:
+            return 0
+        self.acked[i] = 1
+        self.acked_ranges.add(i, i + 1)
+        self.timers.cancel(i)
+        self.retransmits.pop(i, None)
+        self.timeouts.pop(i, None)
+        self.sent_at.pop(i, None)
+        self.highest_acked = max(self.highest_acked, self.sent_as.pop(i, -1))
+        return 1
+
+    # Mark packets [start, end) acknowledged, returns how many were not yet. Only the holes
+    # left in the range are walked, a range that is fully acknowledged costs a lookup.
+    def ack_range(self, start: int, end: int) -> int:
+        start = max(start, self.base)
+        end = min(end, self.count)
+        if end <= start or self.acked_ranges.contains(start, end):
+            return 0
+        return sum(self.ack(i) for hole_start, hole_end in self.acked_ranges.missing(end, start) for i in range(hole_start, hole_end))
+
+    # Move the left edge of the window past the acknowledged packets
+    def advance(self) -> None:
+        while self.base < self.count and self.acked[self.base]:
+            self.base += 1
 
 
 if __name__ == "__main__":
@@ -293,10 +411,31 @@ if __name__ == "__main__":
         type=int,
         required=True,
     )
+    parser.add_argument(
+        "-b",
+        help="The number of packets the sender may send back to back (burst size)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-c",
+        help="The congestion control of the sender: none, reno or vegas",
+        type=str,
+        choices=sorted(ALGORITHMS),
+        default="none",
+    )
+    parser.add_argument(
+        "--reorder",
+        help="Resend a packet once this many packets sent after it were acknowledged (fast retransmit), 0 turns it off",
+        type=int,
+        default=REORDER_THRESHOLD,
+    )
+    add_log_arguments(parser, "summary")
     args = parser.parse_args()
 
     if ((args.p <= 2049) or (args.p >= 65536)) or ((args.g <= 2049) or (args.g >= 65536)):
         print("Port number for both sender and requester should be 2049 < port < 65536")
         exit()
 
-    sender = Sender(args.p, args.g, args.r, args.q, args.l, args.f, args.e, args.i, args.t)
\ No newline at end of file
+    pktlog = PacketLog(args.log_level, args.log_format, args.log_file, sample_every=args.log_sample)
+    sender = Sender(args.p, args.g, args.r, args.q, args.l, args.f, args.e, args.i, args.t, args.b, pktlog, args.c, args.reorder)
\ No newline at end of file
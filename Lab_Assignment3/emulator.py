@@ -1,10 +1,13 @@
 import argparse
 import socket
-import struct
 import time
 import os
+import sys
 import copy
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import codec
+
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # Create socket
 hostIP = socket.gethostbyname(socket.gethostname()) # Get host IP
 
@@ -90,9 +93,9 @@ def createroutes(routeTopology, fowardTable, thisPort):
             # If it is a helloMessage
             if fullPacket[0] == ord('H'):
                 # Unpack header, IP, and Port
-                header = struct.unpack("!BLH", fullPacket)
+                header = codec.HELLO.unpack_from(fullPacket)
                 sourcePort = header[2]
-                sourceIP = socket.inet_ntoa(struct.pack("!L", header[1]))
+                sourceIP = codec.int_to_ip(header[1])
                 
                 # Update the latest timestamp for receiving the helloMessage from the specific neighbor
                 latestTimeStamp[f"{sourceIP},{sourcePort}"] = time.time()
@@ -110,34 +113,33 @@ def createroutes(routeTopology, fowardTable, thisPort):
                     printFowardTable(fowardTable)
 
                     # Send new message to neighbors
-                    linkStateGenMsg = struct.pack("!cLHLL", b'L', struct.unpack("!L", socket.inet_aton(hostIP))[0], int(thisPort), nextSeqNum, 20)
+                    linkStateGenMsg = codec.LINK_STATE.pack(b'L', codec.ip_to_int(hostIP), int(thisPort), nextSeqNum, 20)
                     
                     nextSeqNum += 1
                     
                     # Updated neighbors
                     for neighbor in routeTopology[f"{hostIP},{thisPort}"]:
-                        neighborIP = struct.unpack("!L", socket.inet_aton(neighbor.split(",")[0]))[0]
+                        neighborIP = codec.ip_to_int(neighbor.split(",")[0])
                         neighborPort = int(neighbor.split(",")[1])
-                        linkStateGenMsg += struct.pack("!LHL", neighborIP, neighborPort, 1)
+                        linkStateGenMsg += codec.LINK_STATE_NEIGHBOR.pack(neighborIP, neighborPort, 1)
                     
                     # Foward packet
                     forwardpacket(routeTopology, fowardTable, linkStateGenMsg, None, None, thisPort)
 
             elif fullPacket[0] == ord('L'): # If it is a LinkStateMessage
                 # Unpack packet and get base IP, port, and sequence number
-                headerNoNeighbor = struct.unpack("!LHLL", fullPacket[1:15])
-                basePort = headerNoNeighbor[1]
-                seqNum = headerNoNeighbor[2]
-                baseIP = socket.inet_ntoa(struct.pack("!L", headerNoNeighbor[0]))
+                headerNoNeighbor = codec.LINK_STATE.unpack_from(fullPacket)
+                basePort = headerNoNeighbor[2]
+                seqNum = headerNoNeighbor[3]
+                baseIP = codec.int_to_ip(headerNoNeighbor[1])
 
                 neighbors = []
-                numNeighbors = (len(fullPacket) - 15) // 10
+                numNeighbors = (len(fullPacket) - codec.LINK_STATE.size) // codec.LINK_STATE_NEIGHBOR.size
 
                 # For each neighbor
                 for i in range(numNeighbors):
-                    neighborStruct = fullPacket[(10*i+15):(10*i+25)] # Get struct of neighbor
-                    neighborInfo = struct.unpack("!LHL", neighborStruct) # Get info of neighbor
-                    neighbors.append(f"{socket.inet_ntoa(struct.pack('!L', neighborInfo[0]))},{neighborInfo[1]}") # Append the packet of neighbor
+                    neighborInfo = codec.LINK_STATE_NEIGHBOR.unpack_from(fullPacket, codec.LINK_STATE.size + codec.LINK_STATE_NEIGHBOR.size * i) # Get info of neighbor
+                    neighbors.append(f"{codec.int_to_ip(neighborInfo[0])},{neighborInfo[1]}") # Append the packet of neighbor
 
                 # Check the largest sequence number of the sender node
                 baseID = f"{baseIP},{basePort}"
@@ -170,7 +172,7 @@ def createroutes(routeTopology, fowardTable, thisPort):
             # Send hello message to all neighbors
             for neighbor in neighbors:
                 neighborInfo = neighbor.split(",")
-                hello_msg_packet = struct.pack("!cLH", b'H', struct.unpack("!L", socket.inet_aton(hostIP))[0], int(thisPort))
+                hello_msg_packet = codec.HELLO.pack(b'H', codec.ip_to_int(hostIP), int(thisPort))
                 sock.sendto(hello_msg_packet, (neighborInfo[0], int(neighborInfo[1])))
             
             # Reset timer
@@ -194,14 +196,14 @@ def createroutes(routeTopology, fowardTable, thisPort):
                 printFowardTable(fowardTable)
 
                 # Update message to neighbor
-                linkStateGenMsg = struct.pack("!cLHLL", b'L', struct.unpack("!L", socket.inet_aton(hostIP))[0], int(thisPort), nextSeqNum, 20)
+                linkStateGenMsg = codec.LINK_STATE.pack(b'L', codec.ip_to_int(hostIP), int(thisPort), nextSeqNum, 20)
                 nextSeqNum += 1
 
                 # Update neighbor IP and port in topology
                 for neighbor in routeTopology[f"{hostIP},{thisPort}"]:
-                    neighborIP = struct.unpack("!L", socket.inet_aton(neighbor.split(",")[0]))[0]
+                    neighborIP = codec.ip_to_int(neighbor.split(",")[0])
                     neighborPort = int(neighbor.split(",")[1])
-                    linkStateGenMsg += struct.pack("!LHL", neighborIP, neighborPort, 1)
+                    linkStateGenMsg += codec.LINK_STATE_NEIGHBOR.pack(neighborIP, neighborPort, 1)
 
                 # Foward packets to neighbors
                 forwardpacket(routeTopology, fowardTable, linkStateGenMsg, None, None, thisPort)
@@ -209,14 +211,14 @@ def createroutes(routeTopology, fowardTable, thisPort):
         # Check if interval has passed
         if (time.time() - lsmTime >= lsmTimeout):
             # Updated message
-            linkStateGenMsg = struct.pack("!cLHLL", b'L', struct.unpack("!L", socket.inet_aton(hostIP))[0], int(thisPort), nextSeqNum, 20)
+            linkStateGenMsg = codec.LINK_STATE.pack(b'L', codec.ip_to_int(hostIP), int(thisPort), nextSeqNum, 20)
             nextSeqNum += 1
 
             # Update IP and port for each neighbor in topology
             for neighbor in routeTopology[f"{hostIP},{thisPort}"]:
-                neighborIP = struct.unpack("!L", socket.inet_aton(neighbor.split(",")[0]))[0]
+                neighborIP = codec.ip_to_int(neighbor.split(",")[0])
                 neighborPort = int(neighbor.split(",")[1])
-                linkStateGenMsg += struct.pack("!LHL", neighborIP, neighborPort, 1)
+                linkStateGenMsg += codec.LINK_STATE_NEIGHBOR.pack(neighborIP, neighborPort, 1)
             
             # Foward packet to neighbors
             forwardpacket(routeTopology, fowardTable, linkStateGenMsg, None, None, thisPort)
@@ -231,9 +233,9 @@ def forwardpacket(routeTopology, fowardTable, packet, originalIP, originalPort,
     # Check if packet is "L"
     if packet[0] == ord('L'):
         # Unpack portion of packet
-        miniStruct = struct.unpack("!L", packet[11:15])
-        ttl = miniStruct[0]
-        packet = packet[0:11] + struct.pack("!L", ttl-1) + packet[15:]
+        ttl = codec.TTL.unpack_from(packet, codec.LINK_STATE_TTL_OFFSET)[0]
+        packet = bytearray(packet)
+        codec.TTL.pack_into(packet, codec.LINK_STATE_TTL_OFFSET, ttl-1)
 
         # If TTL is greater than 1
         if ttl > 1:
@@ -249,12 +251,13 @@ def forwardpacket(routeTopology, fowardTable, packet, originalIP, originalPort,
 
     elif packet[0] == ord('T'): # Check if packet is "T"
         # Unpack return packet and get the ports, IPs, and TTL
-        returnPacket = struct.unpack("!cLLHLH", packet)
+        returnPacket = codec.TRACE.unpack_from(packet)
         ttlIn = returnPacket[1]
         returnSourcePort = returnPacket[3]
         returnDestPort = returnPacket[5]
-        returnSourceIP = socket.inet_ntoa(struct.pack("!L", returnPacket[2]))
-        returnDestIP = socket.inet_ntoa(struct.pack("!L", returnPacket[4]))
+        returnSourceIP = codec.int_to_ip(returnPacket[2])
+        returnDestIP = codec.int_to_ip(returnPacket[4])
+        packet = bytearray(packet)
         
         # Check if TTL is greater than 0
         if ttlIn > 0:
@@ -268,7 +271,7 @@ def forwardpacket(routeTopology, fowardTable, packet, originalIP, originalPort,
                 nextPort = int(nextHop.split(",")[1])
 
                 # Make new packet with a decrement TTL
-                packet = packet[:1] + struct.pack("!L", ttlIn-1) + packet[5:]
+                codec.TTL.pack_into(packet, codec.TRACE_TTL_OFFSET, ttlIn-1)
 
                 # Snet packet to the next port
                 sock.sendto(packet, (nextIP, nextPort))
@@ -279,7 +282,7 @@ def forwardpacket(routeTopology, fowardTable, packet, originalIP, originalPort,
             returnPort = returnSourcePort
 
             # Change source IP and port in packet
-            packet = packet[0:5] + struct.pack("!L", struct.unpack("!L", socket.inet_aton(hostIP))[0]) + struct.pack("!H", int(thisPort)) + packet[11:]
+            codec.ADDR_PORT.pack_into(packet, codec.TRACE_SRC_OFFSET, codec.ip_to_int(hostIP), int(thisPort))
             
             # Send new packet to the return port
             sock.sendto(packet, (returnIP, returnPort))
@@ -1,6 +1,10 @@
 import argparse
 import socket
-import struct
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import codec
 
 def trace(port, sourceHostName, sourcePort, destinationHostName, destinationPort, debugOption):
     hostIP = socket.gethostbyname(socket.gethostname()) # Get ip address of host
@@ -12,10 +16,10 @@ def trace(port, sourceHostName, sourcePort, destinationHostName, destinationPort
     liveTTL = 0
 
     # Start printing
-    print(f"Hop#        IP,       Port")
+    print("Hop#        IP,       Port")
     while True:
         # Construct packet
-        returnPacket = struct.pack("!cLLHLH", b'T', liveTTL, struct.unpack("!L", socket.inet_aton(hostIP))[0], int(port), struct.unpack("!L", socket.inet_aton(destIP))[0], int(destinationPort))
+        returnPacket = codec.TRACE.pack(b'T', liveTTL, codec.ip_to_int(hostIP), int(port), codec.ip_to_int(destIP), int(destinationPort))
 
         # Send packet
         sock.sendto(returnPacket, (sourceIP, int(sourcePort)))
@@ -28,7 +32,7 @@ def trace(port, sourceHostName, sourcePort, destinationHostName, destinationPort
         fullPacket, _ = sock.recvfrom(1024)
 
         # Get the return packet
-        returnPacket = struct.unpack("!cLLHLH", fullPacket)
+        returnPacket = codec.TRACE.unpack_from(fullPacket)
 
         # Get info from the return packet
         ttlIn = returnPacket[1] # Get TTL
@@ -38,8 +42,8 @@ def trace(port, sourceHostName, sourcePort, destinationHostName, destinationPort
         returnDestPort = returnPacket[5] # Get Destination Port
 
         # Set source and destination IPs
-        returnSourceIP = socket.inet_ntoa(struct.pack("!L", returnSourceIPNum))
-        returnDestIP = socket.inet_ntoa(struct.pack("!L", returnDestIPNum))
+        returnSourceIP = codec.int_to_ip(returnSourceIPNum)
+        returnDestIP = codec.int_to_ip(returnDestIPNum)
 
         # Print debug info
         if debugOption == "1":
@@ -0,0 +1,50 @@
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.batch import BatchSender, HAVE_SENDMMSG
+
+# Measures packets/second of the plain sendto loop against batched sends over loopback
+
+
+# Best packets/second over a few runs, loopback timings are noisy
+def run(sock: socket.socket, address, packets, batch_size: int, use_sendmmsg: bool, repeats: int) -> float:
+    sender = BatchSender(sock, max_batch=max(1, batch_size), use_sendmmsg=use_sendmmsg)
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, len(packets), batch_size):
+            sender.send(packets[i : i + batch_size], address)
+        best = max(best, len(packets) / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched datagram sends")
+    parser.add_argument("-n", help="number of packets per run", type=int, default=200000)
+    parser.add_argument("-l", help="payload length in bytes", type=int, default=100)
+    parser.add_argument("-b", help="batch sizes to try", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("-k", help="runs per mode, the best one is reported", type=int, default=5)
+    args = parser.parse_args()
+
+    # Nobody reads the receiving socket, the kernel drops what does not fit, which is fine here
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = receiver.getsockname()
+    packets = [bytes(9) + os.urandom(args.l) for _ in range(args.n)]
+
+    print(f"sendmmsg available: {HAVE_SENDMMSG}")
+    print(f"{'mode':<20}{'packets/s':>14}")
+    print(f"{'sendto loop':<20}{run(sock, address, packets, 1, False, args.k):>14,.0f}")
+    for size in args.b:
+        print(f"{'batch ' + str(size) + ' (fallback)':<20}{run(sock, address, packets, size, False, args.k):>14,.0f}")
+        if HAVE_SENDMMSG:
+            print(f"{'batch ' + str(size) + ' (sendmmsg)':<20}{run(sock, address, packets, size, True, args.k):>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
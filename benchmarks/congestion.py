@@ -0,0 +1,112 @@
+import argparse
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+from common.congestion import ALGORITHMS
+
+LAB = os.path.join(ROOT, "Lab_Assignment2")
+EMULATOR_PORT = 3000
+REQUESTER_PORT = 4000
+FIRST_SENDER_PORT = 5000
+
+# Runs several Lab_Assignment2 senders through one emulator at once, each sending one part
+# of a file to the same requester, and reports goodput and drops for every congestion control
+
+
+def write_setup(workdir: str, flows: int, size: int, delay: int) -> None:
+    host = socket.gethostname()
+    with open(os.path.join(workdir, "table"), "w") as f:
+        f.write(f"{host} {EMULATOR_PORT} {host} {REQUESTER_PORT} {host} {REQUESTER_PORT} {delay} 0\n")
+        for i in range(flows):
+            port = FIRST_SENDER_PORT + i
+            f.write(f"{host} {EMULATOR_PORT} {host} {port} {host} {port} {delay} 0\n")
+    with open(os.path.join(workdir, "tracker.txt"), "w") as f:
+        for i in range(flows):
+            f.write(f"file.txt {i + 1} {host} {FIRST_SENDER_PORT + i}\n")
+    for i in range(flows):
+        os.makedirs(os.path.join(workdir, f"s{i}"), exist_ok=True)
+        with open(os.path.join(workdir, f"s{i}", "file.txt"), "w") as f:
+            line = f"flow {i} " * 10 + "\n"
+            f.write((line * (size // len(line) + 1))[:size])
+
+
+# One transfer with every sender using the given congestion control
+def run(workdir: str, mode: str, args) -> dict:
+    python = sys.executable
+    for name in ("file.txt", "file.txt.ckpt", "log"):
+        if os.path.exists(os.path.join(workdir, name)):
+            os.remove(os.path.join(workdir, name))
+    emulator = subprocess.Popen([python, os.path.join(LAB, "emulator.py"), "-p", str(EMULATOR_PORT), "-q", str(args.q),
+                                 "-f", "table", "-l", "log"], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    senders = []
+    try:
+        time.sleep(0.3)
+        for i in range(args.flows):
+            senders.append(subprocess.Popen(
+                [python, os.path.join(LAB, "sender.py"), "-p", str(FIRST_SENDER_PORT + i), "-g", str(REQUESTER_PORT),
+                 "-r", str(args.r), "-q", "1", "-l", str(args.l), "-f", socket.gethostname(), "-e", str(EMULATOR_PORT),
+                 "-i", "1", "-t", str(args.t), "-c", mode, "--log-level", "none"],
+                cwd=os.path.join(workdir, f"s{i}"), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True))
+        time.sleep(0.3)
+        start = time.perf_counter()
+        requester = subprocess.run(
+            [python, os.path.join(LAB, "requester.py"), "-p", str(REQUESTER_PORT), "-o", "file.txt", "-f", socket.gethostname(),
+             "-e", str(EMULATOR_PORT), "-w", str(args.w), "--log-level", "none"],
+            cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+        sender_out = [p.communicate(timeout=args.timeout)[0] for p in senders]
+    finally:
+        for p in senders + [emulator]:
+            p.kill()
+        emulator.wait()
+
+    with open(os.path.join(workdir, "log")) as f:
+        drops = sum("Dropped because queue" in line for line in f)
+    sent = sum(int(m) for out in sender_out for m in re.findall(r"Packets Sent: (\d+)", out))
+    retransmitted = sum(int(m) for out in sender_out for m in re.findall(r"retransmitted: (\d+)", out))
+    # goodput of every flow from the requester summary: bytes over the duration of its transfer
+    flows = [int(b) / max(int(d), 1) for b, d in re.findall(r"total Data Bytes: (\d+)\nAverage Packets/Second: \d+\nDuration of The Test: (\d+)ms", requester.stdout)]
+    expected = b"".join(open(os.path.join(workdir, f"s{i}", "file.txt"), "rb").read() for i in range(args.flows))
+    intact = os.path.exists(os.path.join(workdir, "file.txt")) and open(os.path.join(workdir, "file.txt"), "rb").read() == expected
+    return {"elapsed": elapsed, "goodput": len(expected) / 1000 / elapsed, "flows": flows, "sent": sent,
+            "retransmitted": retransmitted, "drops": drops, "intact": intact}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark congestion control with competing flows through the emulator")
+    parser.add_argument("-n", "--flows", help="number of competing senders", type=int, default=4)
+    parser.add_argument("-s", "--size", help="bytes every sender sends", type=int, default=100000)
+    parser.add_argument("-l", help="payload length in bytes", type=int, default=500)
+    parser.add_argument("-r", help="rate limit of every sender in packets/second, 0 for none", type=int, default=0)
+    parser.add_argument("-w", help="the requester's window", type=int, default=64)
+    parser.add_argument("-t", help="initial retransmission timeout in milliseconds", type=int, default=100)
+    parser.add_argument("-q", help="size of every emulator queue", type=int, default=32)
+    parser.add_argument("-d", help="emulator delay per packet in milliseconds", type=int, default=1)
+    parser.add_argument("-c", help="congestion controls to compare", nargs="+", choices=sorted(ALGORITHMS), default=["none", "reno", "vegas"])
+    parser.add_argument("--timeout", help="seconds a run may take", type=int, default=300)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="cc-bench-")
+    write_setup(workdir, args.flows, args.size, args.d)
+    print(f"{args.flows} flows of {args.size} bytes, queue {args.q}, {args.d}ms per packet, window {args.w}")
+    print(f"{'mode':<8}{'elapsed s':>10}{'goodput KB/s':>14}{'flow KB/s min-max':>20}{'sent':>8}{'retx':>7}{'drops':>7}{'drop rate':>11}{'intact':>8}")
+    try:
+        for mode in args.c:
+            r = run(workdir, mode, args)
+            spread = f"{min(r['flows'], default=0):.0f}-{max(r['flows'], default=0):.0f}"
+            print(f"{mode:<8}{r['elapsed']:>10.2f}{r['goodput']:>14.1f}{spread:>20}{r['sent']:>8}{r['retransmitted']:>7}"
+                  f"{r['drops']:>7}{r['drops'] / max(r['sent'], 1):>11.1%}{str(r['intact']):>8}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Lab_Assignment2"))
+from common import codec
+from requester import Flow
+
+# CPU time per packet the Lab_Assignment2 requester spends finding and updating the state of
+# the sender a packet came from, with many senders at once: the original parallel nested dicts
+# keyed by dotted address string and port, against one flow table keyed by the packed address
+# and port with a slots object per sender. Both build the headers of the ACK, neither touches
+# a socket or the disk.
+
+MY_ADDR = 0x7F000001
+MY_PORT = 4000
+
+
+# One DATA packet from every sender in turn, as they would interleave at the requester
+def make_packets(flows: int, count: int, length: int) -> list:
+    payload = b"x" * length
+    packets = []
+    for i in range(count):
+        flow = i % flows
+        header = codec.HEADER.pack(b"1", 0x0A000000 + flow // 1000, 5000 + flow % 1000, MY_ADDR, MY_PORT,
+                                   codec.INNER_SIZE + length, codec.DATA, socket.htonl(i // flows + 1), length)
+        packets.append(header + payload)
+    return packets
+
+
+def nested_dicts(packets: list) -> int:
+    my_ip = socket.inet_ntoa(MY_ADDR.to_bytes(4, byteorder="big"))
+    startTime, Data_packet_num, total_byte = {}, {}, {}
+    acks = 0
+    for packet in packets:
+        _, src_addr, src_port, dest_addr, dest_port, _ = struct.unpack("!cIHIHI", packet[:17])
+        src_addr = socket.inet_ntoa(src_addr.to_bytes(4, byteorder="big"))
+        dest_addr = socket.inet_ntoa(dest_addr.to_bytes(4, byteorder="big"))
+        if dest_addr != my_ip:
+            continue
+        if src_addr not in Data_packet_num:
+            Data_packet_num[src_addr] = {}
+            total_byte[src_addr] = {}
+            startTime[src_addr] = {}
+        if src_port not in Data_packet_num[src_addr]:
+            Data_packet_num[src_addr][src_port] = 0
+            total_byte[src_addr][src_port] = 0
+            startTime[src_addr][src_port] = time.time()
+        headers = struct.unpack("!cII", packet[17:26])
+        request_type, sequence, length = headers[0].decode(), socket.htonl(headers[1]), headers[2]
+        innerheader = struct.pack("!cII", "A".encode(), socket.htonl(sequence), 0)
+        outerheader = struct.pack("!cIHIHI", "1".encode(), int.from_bytes(socket.inet_aton(dest_addr), byteorder="big"), dest_port,
+                                  int.from_bytes(socket.inet_aton(src_addr), byteorder="big"), src_port, len(innerheader))
+        acks += len(outerheader + innerheader) > 0
+        Data_packet_num[src_addr][src_port] += 1
+        if request_type != "E":
+            total_byte[src_addr][src_port] += length
+    return acks
+
+
+def flow_table(packets: list) -> int:
+    flows = {}
+    acks = 0
+    for packet in packets:
+        (_, src_ip, src_port, dest_ip, dest_port, _), (request_type, sequence, length), payload = codec.unpack_packet(packet)
+        if dest_ip != MY_ADDR:
+            continue
+        flow = flows.get((src_ip, src_port))
+        if flow is None:
+            flow = flows[(src_ip, src_port)] = Flow((src_ip, src_port), None, codec.pack_prefix(b"1", dest_ip, dest_port, src_ip, src_port), 1)
+        flow.seq = sequence
+        acks += len(flow.prefix + codec.pack_tail(codec.ACK, flow.seq, 0)) > 0
+        flow.packets += 1
+        if request_type != codec.END:
+            flow.bytes += length
+    return acks
+
+
+# Best CPU microseconds per packet over a few runs
+def run(mode, packets: list, repeats: int) -> float:
+    best = None
+    for _ in range(repeats):
+        start = time.process_time()
+        mode(packets)
+        per_packet = (time.process_time() - start) / len(packets) * 1e6
+        best = per_packet if best is None else min(best, per_packet)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-packet flow bookkeeping of the Lab_Assignment2 requester")
+    parser.add_argument("-f", "--flows", help="numbers of concurrent senders to try", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("-n", help="packets per run", type=int, default=100000)
+    parser.add_argument("-l", help="payload length in bytes", type=int, default=100)
+    parser.add_argument("-k", help="runs per mode, the best one is reported", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'flows':>6}{'nested dicts us/packet':>24}{'flow table us/packet':>22}")
+    for flows in args.flows:
+        packets = make_packets(flows, args.n, args.l)
+        print(f"{flows:>6}{run(nested_dicts, packets, args.k):>24.2f}{run(flow_table, packets, args.k):>22.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Lab_Assignment2"))
+from common import codec
+from common.batch import BatchSender
+from sender import pack_packets
+
+# CPU time per packet of the Lab_Assignment2 send path: the original loop that built every
+# packet by concatenation, parsed it again and resolved the emulator name on every send,
+# against packets packed once into one buffer and sent as slices of it
+
+
+# The original packet building: one header, inner header and payload concatenated per packet
+def build_concatenated(content: bytes, length: int) -> list:
+    packets = []
+    for i in range(0, len(content), length):
+        payload = content[i:i + length]
+        inner = struct.pack("!cII", b"D", socket.htonl(i // length + 1), len(payload))
+        outer = struct.pack("!cIHIHI", b"1", 0x7F000001, 5000, 0x7F000001, 4000, len(inner) + len(payload))
+        packets.append(outer + inner + payload)
+    return packets
+
+
+def original(sock, host: str, port: int, content: bytes, length: int, window: int) -> int:
+    packets = build_concatenated(content, length)
+    for packet in packets:
+        # every send parsed the packet again for the log and looked the emulator up
+        outer = struct.unpack("!cIHIHI", packet[:codec.OUTER_SIZE])
+        inner = struct.unpack("!cII", packet[codec.OUTER_SIZE:codec.HEADER_SIZE])
+        socket.inet_ntoa(outer[1].to_bytes(4, byteorder="big"))
+        socket.inet_ntoa(outer[3].to_bytes(4, byteorder="big"))
+        inner[0].decode()
+        packet[codec.HEADER_SIZE:].decode()
+        sock.sendto(packet, (socket.gethostbyname(host), port))
+    return len(packets)
+
+
+def resolved(sock, host: str, port: int, content: bytes, length: int, window: int) -> int:
+    packets = build_concatenated(content, length)
+    address = (socket.gethostbyname(host), port)
+    for packet in packets:
+        sock.sendto(packet, address)
+    return len(packets)
+
+
+def contiguous(sock, host: str, port: int, content: bytes, length: int, window: int) -> int:
+    buffer, slices = pack_packets(content, length, 1, b"1", 0x7F000001, 5000, 0x7F000001, 4000)
+    address = (socket.gethostbyname(host), port)
+    batch = BatchSender(sock)
+    for i in range(0, len(slices), window):
+        batch.send_slices(buffer, slices[i:i + window], address)
+    return len(slices)
+
+
+# What the sender does when the window or the pacer grants one packet at a time
+def single_slices(sock, host: str, port: int, content: bytes, length: int, window: int) -> int:
+    buffer, slices = pack_packets(content, length, 1, b"1", 0x7F000001, 5000, 0x7F000001, 4000)
+    address = (socket.gethostbyname(host), port)
+    view = memoryview(buffer)
+    for offset, length in slices:
+        sock.sendto(view[offset:offset + length], address)
+    return len(slices)
+
+
+# Best CPU microseconds per packet over a few runs
+def run(mode, sock, host: str, port: int, content: bytes, length: int, window: int, repeats: int) -> float:
+    best = None
+    for _ in range(repeats):
+        start = time.process_time()
+        count = mode(sock, host, port, content, length, window)
+        per_packet = (time.process_time() - start) / count * 1e6
+        best = per_packet if best is None else min(best, per_packet)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Lab_Assignment2 send path")
+    parser.add_argument("-n", help="number of packets per run", type=int, default=50000)
+    parser.add_argument("-l", help="payload length in bytes", type=int, default=100)
+    parser.add_argument("-w", help="packets handed to the kernel at once (the window)", type=int, default=32)
+    parser.add_argument("-k", help="runs per mode, the best one is reported", type=int, default=5)
+    parser.add_argument("--host", help="emulator host name, resolved like the sender does", default=socket.gethostname())
+    args = parser.parse_args()
+
+    # Nobody reads the receiving socket, the kernel drops what does not fit, which is fine here
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind((socket.gethostbyname(args.host), 0))
+    port = receiver.getsockname()[1]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    content = (b"0123456789abcdef" * (args.n * args.l // 16 + 1))[:args.n * args.l]
+
+    print(f"{'mode':<28}{'CPU us/packet':>14}")
+    for name, mode in (("original (parse + resolve)", original), ("resolved sendto", resolved), ("contiguous send_slices", contiguous),
+                       ("contiguous sendto per slice", single_slices)):
+        print(f"{name:<28}{run(mode, sock, args.host, port, content, args.l, args.w, args.k):>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Code shared by the sender, requester and emulator scripts of all the labs
@@ -0,0 +1,233 @@
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+from typing import List, Optional, Sequence, Tuple, Union
+
+Address = Tuple[str, int]
+Buffer = Union[bytes, bytearray, memoryview]
+Packet = Union[Buffer, Sequence[Buffer]] # A packet is one buffer or a list of buffers sent as one datagram
+
+MAX_BATCH = 64 # Most datagrams handed to the kernel in one call
+MAX_IOV = 4 # Most buffers in one datagram
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+# sendmmsg(2) only exists on Linux, everywhere else the senders fall back to a sendto loop
+def load_sendmmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        func = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    func.restype = ctypes.c_int
+    return func
+
+
+IOVEC = struct.Struct("PN") # struct iovec, packed straight into the preallocated array
+IOVLEN = struct.Struct("N") # msghdr.msg_iovlen
+IOVLEN_OFFSET = msghdr.msg_iovlen.offset
+
+_sendmmsg = load_sendmmsg()
+HAVE_SENDMMSG = _sendmmsg is not None
+
+
+# Sends groups of prebuilt datagrams to one address with as few system calls as possible
+class BatchSender:
+    # Initialize function, use_sendmmsg=False forces the fallback loop
+    def __init__(self, sock: socket.socket, max_batch: int = MAX_BATCH, use_sendmmsg: bool = True) -> None:
+        self.sock = sock
+        self.max_batch = max_batch
+        self.use_sendmmsg = use_sendmmsg and HAVE_SENDMMSG and sock.family == socket.AF_INET
+        self.address = None # Address the sockaddr below was built for
+        self.total_calls = 0 # Number of send system calls made
+        self.total_sent = 0 # Number of datagrams sent
+
+        # The message headers are allocated once and reused for every batch
+        self.msgs = (mmsghdr * max_batch)()
+        self.iovs = (iovec * (max_batch * MAX_IOV))()
+        self.msg_mem = memoryview(self.msgs).cast("B") # Raw views so the fields can be packed quickly
+        self.iov_mem = memoryview(self.iovs).cast("B")
+        self.iovlens = [0] * max_batch # Number of buffers each message currently points at
+        self.single_iov_structs = {} # Cached by batch size, see single_iov_struct
+        self.sockaddr = ctypes.create_string_buffer(16)
+        self.staging = bytearray(MAX_IOV * 2048) # Copies of the read-only buffers of a batch, grown when needed
+        for i in range(max_batch):
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.sockaddr)
+            hdr.msg_namelen = 16
+            hdr.msg_iov = ctypes.cast(ctypes.byref(self.iovs, i * MAX_IOV * ctypes.sizeof(iovec)), ctypes.POINTER(iovec))
+
+    # Send all the packets to the address, returns the number of packets sent
+    def send(self, packets: Sequence[Packet], address: Address) -> int:
+        if not self.use_sendmmsg or len(packets) == 1:
+            for packet in packets:
+                self.send_one(packet, address)
+            return len(packets)
+
+        self.set_address(address)
+        sent = 0
+        while sent < len(packets):
+            chunk = packets[sent : sent + self.max_batch]
+            sent += self.submit(len(chunk), chunk[0], address, self.fill(chunk))
+        return sent
+
+    # Send datagrams that are (offset, length) slices of one writable buffer, such as a bytearray
+    # every packet was packed into. The iovecs point straight into the buffer, so nothing is
+    # copied or wrapped per packet.
+    def send_slices(self, buf: bytearray, slices: Sequence[Tuple[int, int]], address: Address) -> int:
+        view = memoryview(buf)
+        if not self.use_sendmmsg or len(slices) == 1:
+            for offset, length in slices:
+                self.send_one(view[offset : offset + length], address)
+            return len(slices)
+
+        self.set_address(address)
+        memory = (ctypes.c_char * len(buf)).from_buffer(buf) # Keeps the buffer in place until the sends are done
+        base = ctypes.addressof(memory)
+        sent = 0
+        while sent < len(slices):
+            chunk = slices[sent : sent + self.max_batch]
+            fields = []
+            for offset, length in chunk:
+                fields += (base + offset, length)
+            self.single_iov_struct(len(chunk)).pack_into(self.iov_mem, 0, *fields)
+            for i in range(len(chunk)):
+                self.set_iovlen(i, 1)
+            offset, length = chunk[0]
+            sent += self.submit(len(chunk), view[offset : offset + length], address, memory)
+        del memory
+        return sent
+
+    # Hand the first count filled messages to the kernel, returns how many of them were sent.
+    # keep holds the ctypes views the messages point into, they must outlive the system call.
+    def submit(self, count: int, first: Packet, address: Address, keep: object = None) -> int:
+        done = _sendmmsg(self.sock.fileno(), self.msgs, count, 0)
+        self.total_calls += 1
+        if done < 0:
+            err = ctypes.get_errno()
+            if err not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                raise OSError(err, f"sendmmsg: {errno.errorcode.get(err, err)}")
+            # The socket buffer is full, let the socket wait for room (it may have a timeout) for one packet
+            self.send_one(first, address)
+            return 1
+        self.total_sent += done
+        return done
+
+    # Send one packet with a single system call
+    def send_one(self, packet: Packet, address: Address) -> None:
+        if isinstance(packet, (list, tuple)):
+            self.sock.sendmsg(packet, [], 0, address)
+        else:
+            self.sock.sendto(packet, address)
+        self.total_calls += 1
+        self.total_sent += 1
+
+    # Build the sockaddr_in of the address once for as long as it does not change
+    def set_address(self, address: Address) -> None:
+        if address == self.address:
+            return
+        ip = socket.inet_aton(socket.gethostbyname(address[0]))
+        self.sockaddr.raw = struct.pack("=H", socket.AF_INET) + struct.pack("!H", address[1]) + ip + bytes(8)
+        self.address = address
+
+    # Point the preallocated message headers at the packets. Writable buffers are pointed at in
+    # place, read-only ones such as bytes or a slice of a read-only mmap cannot be exported to
+    # ctypes, they are copied into one staging buffer that is reused for every batch.
+    def fill(self, packets: Sequence[Packet]) -> List[object]:
+        if all(type(p) is bytes for p in packets):
+            # Common case of one bytes object per packet, copied in one go and all the iovecs packed in one call
+            data = b"".join(packets)
+            memory = self.stage(len(data))
+            self.staging[: len(data)] = data
+            fields = []
+            address = ctypes.addressof(memory)
+            for p in packets:
+                fields += (address, len(p))
+                address += len(p)
+            self.single_iov_struct(len(packets)).pack_into(self.iov_mem, 0, *fields)
+            for i in range(len(packets)):
+                self.set_iovlen(i, 1)
+            return [memory]
+
+        keep = []
+        staged = [] # (iovec offset, buffer, offset in the staging buffer) of every buffer to copy
+        size = 0
+        for i, packet in enumerate(packets):
+            buffers = packet if isinstance(packet, (list, tuple)) else (packet,)
+            if len(buffers) > MAX_IOV:
+                buffers = (b"".join(buffers),)
+            offset = i * MAX_IOV * IOVEC.size
+            for buf in buffers:
+                address = exported_address(buf, keep)
+                if address is None:
+                    staged.append((offset, buf, size))
+                    size += len(buf)
+                else:
+                    IOVEC.pack_into(self.iov_mem, offset, address, len(buf))
+                offset += IOVEC.size
+            self.set_iovlen(i, len(buffers))
+
+        if staged:
+            memory = self.stage(size)
+            keep.append(memory)
+            base = ctypes.addressof(memory)
+            for offset, buf, at in staged:
+                self.staging[at : at + len(buf)] = buf
+                IOVEC.pack_into(self.iov_mem, offset, base + at, len(buf))
+        return keep
+
+    # The staging buffer with room for size bytes, pinned by the returned view until the call is done
+    def stage(self, size: int) -> ctypes.Array:
+        if len(self.staging) < size:
+            self.staging = bytearray(max(size, 2 * len(self.staging)))
+        return (ctypes.c_char * len(self.staging)).from_buffer(self.staging)
+
+    # Set the number of buffers of one message, only written when it changes
+    def set_iovlen(self, i: int, count: int) -> None:
+        if self.iovlens[i] != count:
+            IOVLEN.pack_into(self.msg_mem, i * ctypes.sizeof(mmsghdr) + IOVLEN_OFFSET, count)
+            self.iovlens[i] = count
+
+    # Struct that writes the first iovec of n messages and skips the unused ones
+    def single_iov_struct(self, n: int) -> struct.Struct:
+        if n not in self.single_iov_structs:
+            self.single_iov_structs[n] = struct.Struct(("PN" + "x" * ((MAX_IOV - 1) * IOVEC.size)) * n)
+        return self.single_iov_structs[n]
+
+
+# Address of the memory behind a writable buffer, kept exported in keep until the system call
+# is done, or None when ctypes cannot point at it without a copy
+def exported_address(buf: Buffer, keep: List[object]) -> Optional[int]:
+    if type(buf) is bytes or (isinstance(buf, memoryview) and buf.readonly):
+        return None
+    try:
+        view = (ctypes.c_char * len(buf)).from_buffer(buf)
+    except (TypeError, ValueError, BufferError):
+        return None
+    keep.append(view)
+    return ctypes.addressof(view)
@@ -0,0 +1,165 @@
+import os
+import struct
+import time
+from typing import Callable, Dict, List, Optional
+
+from common.reassembly import RangeSet
+
+SUFFIX = ".ckpt" # The checkpoint of an output file is kept next to it under this name
+FLUSH_INTERVAL = 0.5 # Seconds between checkpoint writes while a transfer is running
+COMPACT_RECORDS = 4096 # The journal is rewritten with merged ranges once it has this many records
+
+# One journal record: kind, part key, two values
+#   P key base_offset 0   a part starts at base_offset in the output
+#   R key start end       bytes [start, end) of the part are in the output
+#   B key bytes 0         the recorded ranges take up the first bytes of the part on disk,
+#                         for parts whose ranges count packets rather than bytes
+#   S key size 0          the part is size long
+#   C key 0 0             the part is complete
+RECORD = struct.Struct("!cIQQ")
+
+
+# What is known about one part of the output
+class PartState:
+    def __init__(self, base_offset: int) -> None:
+        self.base_offset = base_offset # Where the part starts in the output
+        self.size = None # Length of the part, once its END arrived
+        self.ranges = RangeSet() # Offsets inside the part that are in the output
+        self.written = 0 # Bytes on disk the ranges take up, for ranges that count packets
+        self.complete = False # Whether every byte of the part is in the output
+
+
+# Sidecar journal of which ranges of every part are safely in the output, so a requester
+# that is restarted only asks for what is missing. Records are only appended while the
+# transfer runs, and the journal is compacted to one record per merged range now and then.
+class Checkpoint:
+    def __init__(self, path: str, sync: Optional[Callable[[], None]] = None) -> None:
+        self.path = path
+        self.sync = sync # Makes the output durable, called before ranges are recorded as persisted
+        self.parts: Dict[int, PartState] = {}
+        self.pending: Dict[int, RangeSet] = {} # Ranges written since the last flush
+        self.pending_written: Dict[int, int] = {} # Bytes on disk of the parts those ranges belong to
+        self.records = 0 # Records in the journal
+        self.last_flush = time.monotonic()
+        self.load()
+        self.file = open(path, "ab")
+
+    # Whether an earlier run left anything to resume
+    def resuming(self) -> bool:
+        return bool(self.parts)
+
+    # Replay the journal, a record cut short by a crash is ignored
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % RECORD.size
+        for kind, key, a, b in RECORD.iter_unpack(data[:usable]):
+            self.records += 1
+            if kind == b"P":
+                self.parts[key] = PartState(a)
+            elif key not in self.parts:
+                continue
+            elif kind == b"R":
+                self.parts[key].ranges.add(a, b)
+            elif kind == b"B":
+                self.parts[key].written = a
+            elif kind == b"S":
+                self.parts[key].size = a
+            elif kind == b"C":
+                self.parts[key].complete = True
+        if usable != len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(usable)
+
+    # Size the output had when the journal was last written, anything past it is unrecorded
+    def logical_size(self) -> int:
+        return max((part.base_offset + max(part.size or 0, part.ranges.end()) for part in self.parts.values()), default=0)
+
+    def all_complete(self) -> bool:
+        return all(part.complete for part in self.parts.values())
+
+    # Record that a part starts at base_offset
+    def start_part(self, key: int, base_offset: int) -> PartState:
+        self.parts[key] = PartState(base_offset)
+        self.write(RECORD.pack(b"P", key, base_offset, 0))
+        self.file.flush() # Needed to resume at all, so written right away
+        return self.parts[key]
+
+    # Bytes [start, end) of a part were written to the output, recorded with the next flush.
+    # Ranges that count packets also give the bytes the part takes up on disk with them.
+    def add(self, key: int, start: int, end: int, written: Optional[int] = None) -> None:
+        self.parts[key].ranges.add(start, end)
+        self.pending.setdefault(key, RangeSet()).add(start, end)
+        if written is not None:
+            self.parts[key].written = written
+            self.pending_written[key] = written
+        if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def set_size(self, key: int, size: int) -> None:
+        self.parts[key].size = size
+        self.write(RECORD.pack(b"S", key, size, 0))
+
+    def complete(self, key: int) -> None:
+        self.parts[key].complete = True
+        self.flush()
+        self.write(RECORD.pack(b"C", key, 0, 0))
+        self.file.flush()
+
+    # Write the pending ranges, after the output they describe is durable
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        if self.sync is not None:
+            self.sync()
+        self.write(b"".join(RECORD.pack(b"R", key, start, end) for key, ranges in self.pending.items() for start, end in ranges))
+        self.write(b"".join(RECORD.pack(b"B", key, written, 0) for key, written in self.pending_written.items()))
+        self.pending = {}
+        self.pending_written = {}
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.records >= COMPACT_RECORDS:
+            self.compact()
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.records += len(data) // RECORD.size
+
+    # Rewrite the journal with one record per merged range, replacing the old one atomically
+    def compact(self) -> None:
+        records: List[bytes] = []
+        for key, part in self.parts.items():
+            records.append(RECORD.pack(b"P", key, part.base_offset, 0))
+            records += [RECORD.pack(b"R", key, start, end) for start, end in part.ranges]
+            if part.written:
+                records.append(RECORD.pack(b"B", key, part.written, 0))
+            if part.size is not None:
+                records.append(RECORD.pack(b"S", key, part.size, 0))
+            if part.complete:
+                records.append(RECORD.pack(b"C", key, 0, 0))
+        self.file.close()
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(b"".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.file = open(self.path, "ab")
+        self.records = len(records)
+
+    # Flush and close, the journal is deleted when nothing is left to resume
+    def close(self, remove: bool = False) -> None:
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+        if remove:
+            os.remove(self.path)
+
+
+# Copy of a range set, so a transfer can start from what a checkpoint recorded
+def copy_ranges(ranges: RangeSet) -> RangeSet:
+    return RangeSet(list(ranges))
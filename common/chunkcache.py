@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+ENTRY_OVERHEAD = sys.getsizeof(b"") # Memory a cached file costs on top of its contents
+
+Key = Tuple[str, int, int] # (path, mtime in ns, size)
+
+
+# The contents of one file. Nothing in it depends on the request: the payloads are slices of
+# the contents and every request packs its own headers, so one entry serves any sequence
+# number, payload length and byte range.
+class CacheEntry:
+    def __init__(self, content: bytes, cost: int) -> None:
+        self.content = content
+        self.cost = cost # Bytes charged against the cache capacity
+
+
+# Byte-bounded LRU cache of file contents, so a file that is requested again is not read from
+# disk again. An entry is only reused while the file keeps the same mtime and size.
+class ChunkCache:
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity # Most bytes the entries may cost together
+        self.used = 0 # Bytes the entries cost now
+        self.entries: "OrderedDict[Key, CacheEntry]" = OrderedDict() # Least recently used first
+        self.keys: Dict[str, Key] = {} # Current key of every cached path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock() # Files are opened in worker threads, so lookups may run at once
+
+    # The contents of a file, from the cache or read and cached now. Returns None when the
+    # file is too large to be cached, the caller then sends it straight from the file.
+    # The file is read outside the lock, a miss does not hold up the hits.
+    def content(self, path: str) -> Optional[bytes]:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry.content
+            self.misses += 1
+
+        cost = st.st_size + ENTRY_OVERHEAD
+        if cost > self.capacity:
+            return None
+
+        with open(path, "rb") as f:
+            content = f.read()
+        with self.lock:
+            self.insert(key, CacheEntry(content, cost))
+        return content
+
+    # Add an entry, dropping the older version of the same file and then the least recently used ones
+    def insert(self, key: Key, entry: CacheEntry) -> None:
+        old = self.keys.get(key[0])
+        if old is not None and old in self.entries:
+            self.used -= self.entries.pop(old).cost
+        self.entries[key] = entry
+        self.keys[key[0]] = key
+        self.used += entry.cost
+        while self.used > self.capacity:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.used -= old_entry.cost
+            if self.keys.get(old_key[0]) == old_key:
+                del self.keys[old_key[0]]
+            self.evictions += 1
+
+    # Counters for the log
+    def stats(self) -> str:
+        return f"cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, {self.used} bytes in {len(self.entries)} files"
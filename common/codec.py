@@ -0,0 +1,173 @@
+import socket
+import struct
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+
+# Precompiled packet formats shared by every lab, so nothing is parsed from a format string per packet
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# Lab 1 and 2 packets: type, sequence number, length
+INNER = struct.Struct("!cII")
+INNER_SIZE = INNER.size
+
+# Optional range after the file name of a request. The labs count it in different units, the
+# two names keep them apart although they are laid out alike.
+BYTE_RANGE = struct.Struct("!QQ") # Lab 1: offset and length in bytes
+PACKET_RANGE = struct.Struct("!QQ") # Lab 2: index of the first packet, from 0, and number of packets
+RANGE_SEPARATOR = b"\0" # File names never contain it, so old requests without a range still parse
+
+# Optional payload of a Lab 2 ACK: the cumulative ACK (every sequence number below it was
+# received), optionally the window the requester advertises now, then SACK blocks [start, end)
+# of sequence numbers received above it. With the window the payload is a multiple of 8 bytes
+# long, without it it is not, so ACKs without a window still parse.
+CUMULATIVE_ACK = struct.Struct("!I")
+CUMULATIVE_ACK_WINDOW = struct.Struct("!II")
+SACK_BLOCK = struct.Struct("!II")
+MAX_SACK_BLOCKS = 4 # Most blocks one ACK carries, the one with the packet that triggered it comes first
+
+# Lab 2 emulator header: priority, src addr, src port, dest addr, dest port, length
+OUTER = struct.Struct("!cIHIHI")
+OUTER_SIZE = OUTER.size
+HEADER_SIZE = OUTER_SIZE + INNER_SIZE # Both headers of a Lab 2 packet
+HEADER = struct.Struct("!cIHIHIcII") # Both headers packed in one go
+PREFIX_SIZE = OUTER_SIZE - 4 # The emulator header up to its length, the same for every packet of a flow
+TAIL = struct.Struct("!IcII") # The emulator header length and the inner header, what follows the prefix
+
+# Lab 3 packets
+HELLO = struct.Struct("!cLH") # 'H', addr, port
+LINK_STATE = struct.Struct("!cLHLL") # 'L', addr, port, sequence number, TTL
+LINK_STATE_NEIGHBOR = struct.Struct("!LHL") # addr, port, cost
+TRACE = struct.Struct("!cLLHLH") # 'T', TTL, src addr, src port, dest addr, dest port
+TTL = struct.Struct("!L")
+
+LINK_STATE_TTL_OFFSET = 11 # Offset of the TTL inside a link state packet
+TRACE_TTL_OFFSET = 1 # Offset of the TTL inside a trace packet
+TRACE_SRC_OFFSET = 5 # Offset of the source addr and port inside a trace packet
+ADDR_PORT = struct.Struct("!LH")
+
+DATA = b"D"
+END = b"E"
+REQUEST = b"R"
+ACK = b"A"
+
+# The senders have always written the sequence number through htonl() into a "!I" field,
+# so on the wire it is in host order. Kept as is so old and new scripts still understand each other.
+_htonl = socket.htonl
+
+
+def pack_inner(packet_type: bytes, seq: int, length: int) -> bytes:
+    return INNER.pack(packet_type, _htonl(seq), length)
+
+
+def pack_inner_into(buf: Buffer, offset: int, packet_type: bytes, seq: int, length: int) -> None:
+    INNER.pack_into(buf, offset, packet_type, _htonl(seq), length)
+
+
+# Pack both headers of a Lab 2 packet at offset, length is the payload length
+def pack_header_into(buf: Buffer, offset: int, priority: bytes, src_addr: int, src_port: int, dest_addr: int, dest_port: int,
+                     packet_type: bytes, seq: int, length: int) -> None:
+    HEADER.pack_into(buf, offset, priority, src_addr, src_port, dest_addr, dest_port, INNER_SIZE + length, packet_type, _htonl(seq), length)
+
+
+# Start of every packet of a flow: priority, addresses and ports, packed once per flow
+def pack_prefix(priority: bytes, src_addr: int, src_port: int, dest_addr: int, dest_port: int) -> bytes:
+    return OUTER.pack(priority, src_addr, src_port, dest_addr, dest_port, 0)[:PREFIX_SIZE]
+
+
+# Rest of both headers after a flow's prefix, length is the payload length
+def pack_tail(packet_type: bytes, seq: int, length: int) -> bytes:
+    return TAIL.pack(INNER_SIZE + length, packet_type, _htonl(seq), length)
+
+
+# Returns (type, sequence number, length) of the inner header at offset
+def unpack_inner(buf: Buffer, offset: int = 0) -> Tuple[bytes, int, int]:
+    packet_type, seq, length = INNER.unpack_from(buf, offset)
+    return packet_type, _htonl(seq), length
+
+
+# Payload of a Lab 1 request: the file name, then the byte range if only part of the file is wanted
+def pack_request(filename: str, byte_range: Optional[Tuple[int, int]] = None) -> bytes:
+    return _pack_request(filename, byte_range, BYTE_RANGE)
+
+
+# Returns (file name, (offset, length) in bytes or None) of a Lab 1 request payload
+def unpack_request(payload: Buffer) -> Tuple[str, Optional[Tuple[int, int]]]:
+    return _unpack_request(payload, BYTE_RANGE)
+
+
+# Payload of a Lab 2 request: the file name, then the packet range if only some packets are wanted
+def pack_packet_request(filename: str, packet_range: Optional[Tuple[int, int]] = None) -> bytes:
+    return _pack_request(filename, packet_range, PACKET_RANGE)
+
+
+# Returns (file name, (first packet, count) or None) of a Lab 2 request payload
+def unpack_packet_request(payload: Buffer) -> Tuple[str, Optional[Tuple[int, int]]]:
+    return _unpack_request(payload, PACKET_RANGE)
+
+
+def _pack_request(filename: str, rng: Optional[Tuple[int, int]], fmt: struct.Struct) -> bytes:
+    if rng is None:
+        return filename.encode()
+    return filename.encode() + RANGE_SEPARATOR + fmt.pack(*rng)
+
+
+def _unpack_request(payload: Buffer, fmt: struct.Struct) -> Tuple[str, Optional[Tuple[int, int]]]:
+    payload = bytes(payload)
+    name, separator, rest = payload.partition(RANGE_SEPARATOR)
+    if not separator or len(rest) != fmt.size:
+        return payload.decode(), None
+    return name.decode(), fmt.unpack(rest)
+
+
+# Payload of an ACK: the cumulative ACK, the window if one is advertised and up to MAX_SACK_BLOCKS blocks
+def pack_ack(cumulative: int, blocks: List[Tuple[int, int]] = (), window: Optional[int] = None) -> bytes:
+    head = CUMULATIVE_ACK.pack(cumulative) if window is None else CUMULATIVE_ACK_WINDOW.pack(cumulative, window)
+    return head + b"".join(SACK_BLOCK.pack(start, end) for start, end in blocks[:MAX_SACK_BLOCKS])
+
+
+# Returns (cumulative ACK, SACK blocks, window) of an ACK payload, (None, [], None) when the ACK
+# only names its own packet, the window is None when the ACK does not advertise one
+def unpack_ack(payload: Buffer) -> Tuple[Optional[int], List[Tuple[int, int]], Optional[int]]:
+    if len(payload) < CUMULATIVE_ACK.size:
+        return None, [], None
+    window = None
+    if len(payload) % SACK_BLOCK.size == 0:
+        cumulative, window = CUMULATIVE_ACK_WINDOW.unpack_from(payload)
+        first = CUMULATIVE_ACK_WINDOW.size
+    else:
+        cumulative, = CUMULATIVE_ACK.unpack_from(payload)
+        first = CUMULATIVE_ACK.size
+    blocks = [SACK_BLOCK.unpack_from(payload, offset) for offset in range(first, len(payload) - SACK_BLOCK.size + 1, SACK_BLOCK.size)]
+    return cumulative, blocks, window
+
+
+def pack_outer(priority: bytes, src_addr: int, src_port: int, dest_addr: int, dest_port: int, length: int) -> bytes:
+    return OUTER.pack(priority, src_addr, src_port, dest_addr, dest_port, length)
+
+
+def pack_outer_into(buf: Buffer, offset: int, priority: bytes, src_addr: int, src_port: int, dest_addr: int, dest_port: int, length: int) -> None:
+    OUTER.pack_into(buf, offset, priority, src_addr, src_port, dest_addr, dest_port, length)
+
+
+# Returns (priority, src addr, src port, dest addr, dest port, length), addresses stay packed ints
+def unpack_outer(buf: Buffer) -> Tuple[bytes, int, int, int, int, int]:
+    return OUTER.unpack_from(buf, 0)
+
+
+# Parse both headers of a Lab 2 packet without copying it, the payload is a view into buf
+def unpack_packet(buf: Buffer) -> Tuple[Tuple[bytes, int, int, int, int, int], Tuple[bytes, int, int], memoryview]:
+    view = buf if isinstance(buf, memoryview) else memoryview(buf)
+    return OUTER.unpack_from(view, 0), unpack_inner(view, OUTER_SIZE), view[HEADER_SIZE:]
+
+
+# Dotted address string to the packed int used in the headers
+@lru_cache(maxsize=1024)
+def ip_to_int(ip: str) -> int:
+    return int.from_bytes(socket.inet_aton(ip), byteorder="big")
+
+
+# Packed int address back to a dotted string, only needed for printing and for the socket calls
+@lru_cache(maxsize=1024)
+def int_to_ip(addr: int) -> str:
+    return socket.inet_ntoa(addr.to_bytes(4, byteorder="big"))
@@ -0,0 +1,111 @@
+import math
+from typing import Dict, List, Optional, Type
+
+INITIAL_WINDOW = 2.0 # Packets a flow may have in flight before its first ACK
+MIN_WINDOW = 1.0 # The window never shrinks below this
+VEGAS_ALPHA = 2 # Vegas grows the window while fewer packets than this sit in queues
+VEGAS_BETA = 4 # and shrinks it while more than this do
+VEGAS_GAMMA = 1 # Slow start ends once this many packets are queued
+
+
+# Congestion window of one flow in packets, adjusted from ACKs and losses. The sender keeps
+# no more than min(window, advertised window) packets in flight. This base class never
+# limits anything, so a sender without congestion control behaves as before.
+class CongestionControl:
+    name = "none"
+
+    def __init__(self) -> None:
+        self.cwnd = math.inf # Congestion window in packets
+        self.ssthresh = math.inf # Slow start threshold
+        self.recover = -1 # Losses of packets sent before this index belong to the last loss event
+        self.loss_events = 0
+        self.max_cwnd = 0.0
+        self.max_window = math.inf # The advertised window, the congestion window never grows past it
+
+    # Packets that may be in flight now
+    def window(self) -> int:
+        return max(int(MIN_WINDOW), int(min(self.cwnd, 1 << 30)))
+
+    # A new packet was acknowledged, rtt is None when the packet was retransmitted (Karn's rule)
+    def on_ack(self, rtt: Optional[float]) -> None:
+        pass
+
+    # The packet at index was lost while packets up to next_index had been sent, found by its
+    # timer running out or else by later packets overtaking it. Every loss of a packet sent
+    # before the previous loss was noticed is part of the same event.
+    def on_loss(self, index: int, next_index: int, timeout: bool = True) -> None:
+        if index < self.recover:
+            return
+        self.recover = next_index
+        self.loss_events += 1
+        self.reduce(timeout)
+
+    # Shrink the window after a loss event
+    def reduce(self, timeout: bool) -> None:
+        pass
+
+    # Keep the window below the advertised one after it grew
+    def grew(self) -> None:
+        self.cwnd = min(self.cwnd, self.max_window)
+        self.max_cwnd = max(self.max_cwnd, self.cwnd)
+
+    # Lines for the end-of-transfer stats
+    def stats(self) -> List[str]:
+        if math.isinf(self.cwnd):
+            return []
+        return [f"Congestion control: {self.name}, window {self.cwnd:.1f} packets (largest {self.max_cwnd:.1f}), {self.loss_events} loss events"]
+
+
+# AIMD like TCP Reno: slow start up to ssthresh, then one packet more per RTT. After a loss
+# ssthresh drops to half the window, the window goes back to one packet after a timeout and
+# to ssthresh after a fast retransmit
+class Reno(CongestionControl):
+    name = "reno"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.cwnd = INITIAL_WINDOW
+
+    def on_ack(self, rtt: Optional[float]) -> None:
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1
+        else:
+            self.cwnd += 1 / self.cwnd
+        self.grew()
+
+    def reduce(self, timeout: bool) -> None:
+        self.ssthresh = max(self.cwnd / 2, 2 * MIN_WINDOW)
+        self.cwnd = MIN_WINDOW if timeout else self.ssthresh
+
+
+# Delay based like TCP Vegas: the difference between the expected and the actual rate
+# says how many packets of the flow sit in queues, the window grows while there are fewer
+# than VEGAS_ALPHA and shrinks while there are more than VEGAS_BETA, before anything is dropped
+class Vegas(CongestionControl):
+    name = "vegas"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.cwnd = INITIAL_WINDOW
+        self.base_rtt = math.inf # Smallest RTT seen, taken as the RTT with empty queues
+
+    def on_ack(self, rtt: Optional[float]) -> None:
+        if rtt is None:
+            return
+        self.base_rtt = min(self.base_rtt, rtt)
+        queued = self.cwnd * (1 - self.base_rtt / rtt) # Packets of the flow in queues
+        if self.cwnd < self.ssthresh and queued < VEGAS_GAMMA:
+            self.cwnd += 1
+        elif queued < VEGAS_ALPHA:
+            self.cwnd += 1 / self.cwnd
+        elif queued > VEGAS_BETA:
+            self.ssthresh = min(self.ssthresh, self.cwnd)
+            self.cwnd = max(2 * MIN_WINDOW, self.cwnd - 1 / self.cwnd)
+        self.grew()
+
+    def reduce(self, timeout: bool) -> None:
+        self.ssthresh = max(self.cwnd / 2, 2 * MIN_WINDOW)
+        self.cwnd = self.ssthresh
+
+
+ALGORITHMS: Dict[str, Type[CongestionControl]] = {cls.name: cls for cls in (CongestionControl, Reno, Vegas)}
@@ -0,0 +1,82 @@
+import time
+
+# Waits shorter than this are spun out instead of slept, since sleep() overshoots
+SPIN_THRESHOLD = 0.002
+
+
+# Token bucket that paces packets to a fixed rate
+class Pacer:
+    # Initialize function, a rate of 0 or less disables pacing
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = float(rate) # Tokens (packets) added per second
+        self.burst = max(1, int(burst)) # Most tokens that can pile up while idle
+        self.tokens = float(self.burst) # Start full so the first burst goes out right away
+        self.last_refill = time.monotonic() # Last time tokens were added
+        self.first_send = None # Time the first packet was let through
+        self.last_send = None # Time the last packet was let through
+        self.total_sent = 0 # Number of packets let through
+
+    # Add the tokens earned since the last refill, never more than the burst size
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    # Take n tokens and return how long to wait (in seconds) before sending them.
+    # The bucket may go negative, so later callers queue behind earlier ones and
+    # time lost to oversleeping is paid back instead of piling up.
+    def delay(self, n: int = 1) -> float:
+        now = time.monotonic()
+        wait = 0.0
+        if self.rate > 0:
+            self.refill(now)
+            self.tokens -= n
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+
+        self.record(n, now + wait)
+        return wait
+
+    # Block until n tokens are available
+    def wait(self, n: int = 1) -> None:
+        wait = self.delay(n)
+        if wait > 0:
+            sleep_until(time.monotonic() + wait)
+
+    # Block until min(n, burst) tokens are available, then take them and return that number,
+    # so callers send batches as large as the burst allows at the same average rate
+    def take(self, n: int) -> int:
+        now = time.monotonic()
+        if self.rate > 0:
+            n = max(1, min(n, self.burst))
+            self.refill(now)
+            if self.tokens < n:
+                now = now + (n - self.tokens) / self.rate
+                sleep_until(now)
+                self.refill(now)
+            self.tokens -= n
+
+        self.record(n, now)
+        return n
+
+    # Keep the numbers needed for achieved_rate
+    def record(self, n: int, when: float) -> None:
+        if self.first_send is None:
+            self.first_send = when
+        self.last_send = when
+        self.total_sent += n
+
+    # Packets per second actually let through so far
+    def achieved_rate(self) -> float:
+        if self.total_sent < 2 or self.last_send <= self.first_send:
+            return 0.0
+        # The first packet opens the measurement, so it is not counted in it
+        return (self.total_sent - 1) / (self.last_send - self.first_send)
+
+
+# Sleep for most of the time, then spin on the monotonic clock for the rest
+def sleep_until(deadline: float) -> None:
+    remaining = deadline - time.monotonic()
+    if remaining > SPIN_THRESHOLD:
+        time.sleep(remaining - SPIN_THRESHOLD)
+    while time.monotonic() < deadline:
+        pass
@@ -0,0 +1,190 @@
+import argparse
+import socket
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+LEVELS = ("none", "summary", "sampled", "full")
+FORMATS = ("text", "csv", "binary")
+
+CAPACITY = 1 << 16 # Events the ring holds before new ones are dropped
+FLUSH_INTERVAL = 0.5 # Seconds between background flushes when the ring is not filling up
+SAMPLE_EVERY = 100 # In "sampled" mode every this many DATA events is kept
+
+# One binary record: time, type, peer address, peer port, sequence number, length, payload head length,
+# payload head. Every record names its peer, so the file can be read without any other state.
+RECORD = struct.Struct("<dc4sHQIB4s")
+
+Peer = Tuple[str, int]
+# Formats one event for the text output: (type, time, sequence number, length, peer, payload head) -> text
+Formatter = Callable[[str, float, int, int, Peer, bytes], str]
+
+
+# Add the logging options every sender and requester shares
+def add_log_arguments(parser: argparse.ArgumentParser, default_level: str) -> None:
+    parser.add_argument("--log-level", help="per-packet logging: none (no summaries either), summary, sampled or full", choices=LEVELS, default=default_level)
+    parser.add_argument("--log-format", help="per-packet log format: text, csv or binary", choices=FORMATS, default="text")
+    parser.add_argument("--log-file", help="write the per-packet log here instead of stdout", type=str, default=None)
+    parser.add_argument("--log-sample", help="keep one DATA event in this many with --log-level sampled", type=int, default=SAMPLE_EVERY)
+
+
+# Format a time the way the scripts always printed it
+def format_time(when: float) -> str:
+    return datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+# A dotted address as 4 bytes for the binary format, zeros when the peer is not known
+def pack_address(addr: str) -> bytes:
+    try:
+        return socket.inet_aton(addr)
+    except OSError:
+        return bytes(4)
+
+
+# Records per-packet events into a preallocated ring buffer. Nothing is formatted or
+# written on the packet path, a background thread (or flush()) does that later.
+class PacketLog:
+    def __init__(self, level: str = "full", fmt: str = "text", path: Optional[str] = None,
+                 formatter: Optional[Formatter] = None, sample_every: int = SAMPLE_EVERY, capacity: int = CAPACITY) -> None:
+        self.level = level
+        self.fmt = fmt
+        self.formatter = formatter
+        # DATA events kept: every one, one in sample_every, or none at all
+        self.every = {"full": 1, "sampled": max(1, sample_every)}.get(level, 0)
+        self.capacity = capacity
+        self.head = 0 # Events written so far
+        self.tail = 0 # Events flushed so far
+        self.seen = 0 # DATA events offered, kept or not
+        self.dropped = 0 # Events lost because the ring was full
+
+        self.times = array("d", bytes(8 * capacity))
+        self.kinds = bytearray(capacity)
+        self.seqs = array("Q", bytes(8 * capacity))
+        self.lengths = array("I", bytes(4 * capacity))
+        self.peer_ids = array("H", bytes(2 * capacity))
+        self.heads = bytearray(4 * capacity) # First bytes of every payload
+        self.head_lens = bytearray(capacity)
+        self.peers: List[Peer] = []
+        self.peer_index: Dict[Peer, int] = {}
+        self.peer_addrs: List[bytes] = [] # Packed address of every peer, for the binary format
+
+        self.out = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.thread = None
+        if self.every:
+            self.out = open(path, "wb" if fmt == "binary" else "w") if path else None
+            if fmt == "csv":
+                self.write_text("time,type,peer,seq,length,payload\n")
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    # Whether per-packet events are recorded at all
+    def enabled(self) -> bool:
+        return self.every != 0
+
+    # Whether the summaries at the end of a transfer are printed, "none" turns them off as well
+    def summaries(self) -> bool:
+        return self.level != "none"
+
+    # Record one packet, cheap enough to call on every packet
+    def record(self, kind: str, seq: int, length: int, payload: bytes = b"", peer: Peer = ("", 0)) -> None:
+        if not self.every:
+            return
+        if kind == "D":
+            self.seen += 1
+            if self.seen % self.every:
+                return
+        if self.head - self.tail >= self.capacity:
+            self.dropped += 1
+            self.wake.set()
+            return
+
+        i = self.head % self.capacity
+        self.times[i] = time.time()
+        self.kinds[i] = ord(kind)
+        self.seqs[i] = seq
+        self.lengths[i] = length
+        peer_id = self.peer_index.get(peer)
+        if peer_id is None:
+            peer_id = self.peer_index[peer] = len(self.peers)
+            self.peers.append(peer)
+            self.peer_addrs.append(pack_address(peer[0]))
+        self.peer_ids[i] = peer_id
+        head = bytes(payload[:4])
+        self.heads[4 * i : 4 * i + len(head)] = head
+        self.head_lens[i] = len(head)
+        self.head += 1
+
+        if self.head - self.tail >= self.capacity // 2:
+            self.wake.set()
+
+    # Background thread, writes out what was recorded every FLUSH_INTERVAL or when the ring fills up
+    def run(self) -> None:
+        while not self.stopped:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            self.flush()
+
+    # Write out everything recorded so far
+    def flush(self) -> None:
+        with self.lock:
+            head = self.head
+            if head == self.tail:
+                return
+            if self.fmt == "binary":
+                out = bytearray()
+                for n in range(self.tail, head):
+                    i = n % self.capacity
+                    peer_id = self.peer_ids[i]
+                    out += RECORD.pack(self.times[i], bytes((self.kinds[i],)), self.peer_addrs[peer_id], self.peers[peer_id][1],
+                                       self.seqs[i], self.lengths[i], self.head_lens[i], bytes(self.heads[4 * i : 4 * i + 4]))
+                self.write_binary(bytes(out))
+            else:
+                self.write_text("".join(self.format(n % self.capacity) for n in range(self.tail, head)))
+            self.tail = head
+
+    # One event as text
+    def format(self, i: int) -> str:
+        kind, when, seq, length = chr(self.kinds[i]), self.times[i], self.seqs[i], self.lengths[i]
+        peer = self.peers[self.peer_ids[i]]
+        head = bytes(self.heads[4 * i : 4 * i + self.head_lens[i]])
+        if self.fmt == "csv":
+            return f"{when:.6f},{kind},{peer[0]}:{peer[1]},{seq},{length},{head.hex()}\n"
+        if self.formatter is not None:
+            return self.formatter(kind, when, seq, length, peer, head)
+        return f"{format_time(when)} {kind} {peer[0]}:{peer[1]} seq={seq} length={length}\n"
+
+    def write_text(self, text: str) -> None:
+        if self.out is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        else:
+            self.out.write(text)
+
+    def write_binary(self, data: bytes) -> None:
+        if self.out is None:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+        else:
+            self.out.write(data)
+
+    # Flush what is left and stop the background thread
+    def close(self) -> None:
+        if self.thread is not None:
+            self.stopped = True
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        if self.dropped:
+            print(f"[Warning] {self.dropped} packet log events were dropped, the log could not keep up")
+            self.dropped = 0
+        if self.out is not None:
+            self.out.close()
+            self.out = None
@@ -0,0 +1,148 @@
+import os
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Tuple
+
+PREALLOCATE_STEP = 8 << 20 # The output file grows at least this much at a time
+
+
+# Set of byte ranges [start, end), kept sorted and merged so it stays small
+# however the packets arrive. It only grows with the number of holes.
+class RangeSet:
+    def __init__(self, ranges: List[Tuple[int, int]] = ()) -> None:
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        for start, end in ranges:
+            self.add(start, end)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return iter(zip(self.starts, self.ends))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    # Add [start, end), returns how many of its bytes were not in the set yet
+    def add(self, start: int, end: int) -> int:
+        if end <= start:
+            return 0
+        # All the ranges that touch or overlap [start, end) are merged into one
+        lo = bisect_left(self.ends, start)
+        hi = bisect_right(self.starts, end)
+        if lo == hi:
+            self.starts.insert(lo, start)
+            self.ends.insert(lo, end)
+            return end - start
+
+        overlap = sum(min(end, e) - max(start, s) for s, e in zip(self.starts[lo:hi], self.ends[lo:hi]) if s < end and e > start)
+        new_start = min(start, self.starts[lo])
+        new_end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [new_start]
+        self.ends[lo:hi] = [new_end]
+        return (end - start) - overlap
+
+    # Whether every byte of [start, end) is in the set
+    def contains(self, start: int, end: int) -> bool:
+        i = bisect_right(self.starts, start) - 1
+        return i >= 0 and self.ends[i] >= end
+
+    # Number of bytes in the set
+    def total(self) -> int:
+        return sum(self.ends) - sum(self.starts)
+
+    # End of the last range, 0 when empty
+    def end(self) -> int:
+        return self.ends[-1] if self.ends else 0
+
+    # Length of the run that starts at 0
+    def contiguous(self) -> int:
+        return self.ends[0] if self.starts and self.starts[0] == 0 else 0
+
+    # The holes inside [first, size)
+    def missing(self, size: int, first: int = 0) -> List[Tuple[int, int]]:
+        gaps = []
+        position = first
+        for start, end in self:
+            if end <= first:
+                continue
+            if start >= size:
+                break
+            if start > position:
+                gaps.append((position, start))
+            position = max(position, end)
+        if position < size:
+            gaps.append((position, size))
+        return gaps
+
+
+# Output file that is written with positional writes and grown ahead of the writes,
+# so a packet that lands far past the current end does not extend the file piece by piece
+class OutputFile:
+    def __init__(self, path: str, truncate: bool = False) -> None:
+        flags = os.O_RDWR | os.O_CREAT | (os.O_TRUNC if truncate else 0)
+        self.fd = os.open(path, flags, 0o644)
+        self.size = os.fstat(self.fd).st_size # Logical size, what the file is cut back to on close
+        self.allocated = self.size # Bytes the file really has on disk
+
+    def __enter__(self) -> "OutputFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # Make sure the file has room up to end
+    def reserve(self, end: int) -> None:
+        if end <= self.allocated:
+            return
+        target = max(end, self.allocated + PREALLOCATE_STEP)
+        try:
+            os.posix_fallocate(self.fd, self.allocated, target - self.allocated)
+        except (AttributeError, OSError):
+            os.ftruncate(self.fd, target) # No fallocate here, a sparse file still avoids the appends
+        self.allocated = target
+
+    def write_at(self, offset: int, data) -> None:
+        self.reserve(offset + len(data))
+        os.pwrite(self.fd, data, offset)
+        self.size = max(self.size, offset + len(data))
+
+    def append(self, data) -> None:
+        self.write_at(self.size, data)
+
+    # Make everything written so far durable
+    def sync(self) -> None:
+        os.fsync(self.fd)
+
+    def close(self) -> None:
+        if self.fd is None:
+            return
+        if self.allocated != self.size:
+            os.ftruncate(self.fd, self.size) # Drop what was preallocated but never written
+        os.close(self.fd)
+        self.fd = None
+
+
+# Places the payloads of one transfer at their offsets inside a region of an output file
+class Reassembler:
+    def __init__(self, output: OutputFile, base_offset: int) -> None:
+        self.output = output
+        self.base_offset = base_offset # Where offset 0 of this transfer is in the file
+        self.received = RangeSet() # Offsets (relative to base_offset) already written
+        self.duplicates = 0 # Payloads that were already written before
+
+    # Write a payload at its offset, returns False if it was a duplicate
+    def write(self, offset: int, payload) -> bool:
+        end = offset + len(payload)
+        if end == offset:
+            return True # Empty payloads (an empty file or range) have nothing to place
+        if self.received.contains(offset, end):
+            self.duplicates += 1
+            return False
+        self.output.write_at(self.base_offset + offset, payload)
+        self.received.add(offset, end)
+        return True
+
+    # Set the final length of the transfer once it is known, returns the holes left in it.
+    # first is where the transfer started when it only covers the part of the file from there.
+    def finish(self, size: int, first: int = 0) -> List[Tuple[int, int]]:
+        size = max(size, self.received.end())
+        self.output.size = max(self.output.size, self.base_offset + size)
+        return self.received.missing(size, first)
@@ -0,0 +1,69 @@
+import time
+from typing import List, Optional, Tuple
+
+ALPHA = 1 / 8 # Weight of a new sample in the smoothed RTT (RFC 6298)
+BETA = 1 / 4 # Weight of a new sample in the RTT variance
+K = 4 # The timeout stays this many variances above the smoothed RTT
+MAX_RTO = 60.0 # Backing off never makes the timeout longer than this (seconds)
+HISTORY_INTERVAL = 0.5 # Seconds between the points kept of how the estimate evolved
+
+
+# RTT estimation and retransmission timeout of one flow, after RFC 6298. Only packets
+# that were sent once are sampled (Karn's rule). Every packet backs off on its own, its
+# timeout doubles each time its timer runs out, so a burst of losses does not stall the flow.
+class RttEstimator:
+    def __init__(self, initial_rto: float, min_rto: Optional[float] = None, max_rto: float = MAX_RTO) -> None:
+        self.min_rto = initial_rto if min_rto is None else min_rto # The RTO never drops below this
+        self.max_rto = max(max_rto, self.min_rto)
+        self.rto = initial_rto # Current retransmission timeout
+        self.srtt = None # Smoothed RTT, None until the first sample
+        self.rttvar = None # RTT variance
+        self.samples = 0
+        self.total_rtt = 0.0
+        self.min_rtt = None
+        self.max_rtt = None
+        self.timeouts = 0 # Retransmission timers that ran out
+        self.start = time.monotonic()
+        self.history: List[Tuple[float, float, float]] = [] # (seconds since start, smoothed RTT, RTO)
+        self.note()
+
+    # Take the RTT of a packet that was only sent once
+    def sample(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + K * self.rttvar))
+        self.samples += 1
+        self.total_rtt += rtt
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.max_rtt = rtt if self.max_rtt is None else max(self.max_rtt, rtt)
+        self.note()
+
+    # Timeout of a packet whose timer already ran out this many times, doubled for each
+    def timeout(self, expiries: int = 0) -> float:
+        return min(self.max_rto, self.rto * (1 << expiries))
+
+    # A retransmission timer ran out
+    def timed_out(self) -> None:
+        self.timeouts += 1
+        self.note()
+
+    # Keep a point of the evolution every HISTORY_INTERVAL
+    def note(self) -> None:
+        elapsed = time.monotonic() - self.start
+        if not self.history or elapsed - self.history[-1][0] >= HISTORY_INTERVAL:
+            self.history.append((elapsed, self.srtt or 0.0, self.rto))
+
+    # Lines for the end-of-transfer stats
+    def stats(self) -> List[str]:
+        self.history.append((time.monotonic() - self.start, self.srtt or 0.0, self.rto))
+        lines = [f"RTO: {self.rto * 1000:.1f}ms, {self.timeouts} timeouts"]
+        if self.samples:
+            lines.append(f"RTT: {self.samples} samples, min {self.min_rtt * 1000:.2f}ms, "
+                         f"avg {self.total_rtt / self.samples * 1000:.2f}ms, max {self.max_rtt * 1000:.2f}ms, "
+                         f"smoothed {self.srtt * 1000:.2f}ms, variance {self.rttvar * 1000:.2f}ms")
+        lines += [f"  at {elapsed:.2f}s: srtt {srtt * 1000:.2f}ms, rto {rto * 1000:.1f}ms" for elapsed, srtt, rto in self.history]
+        return lines
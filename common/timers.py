@@ -0,0 +1,58 @@
+import heapq
+from typing import Dict, Hashable, List, Optional, Tuple
+
+COMPACT_FACTOR = 2 # The heap is rebuilt once it holds this many times more entries than live timers
+
+
+# Deadlines of many timers in one heap. Arming is a push, cancelling only forgets the
+# timer, its heap entry is dropped when it comes up (lazy cancellation), so the event
+# loop can arm and cancel a timer per packet and still find the next expiry at once.
+class TimerQueue:
+    def __init__(self) -> None:
+        self.heap: List[Tuple[float, int, Hashable]] = [] # (deadline, arm count, key), may hold cancelled entries
+        self.deadlines: Dict[Hashable, Tuple[float, int]] = {} # Live deadline and arm count of every timer
+        self.armed = 0 # Times any timer was armed, tells a re-armed timer from its earlier entries
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.deadlines
+
+    # Arm the timer of key, replacing its earlier deadline
+    def arm(self, key: Hashable, deadline: float) -> None:
+        self.armed += 1
+        self.deadlines[key] = (deadline, self.armed)
+        heapq.heappush(self.heap, (deadline, self.armed, key))
+        if len(self.heap) > COMPACT_FACTOR * len(self.deadlines) + 64:
+            self.compact()
+
+    def cancel(self, key: Hashable) -> None:
+        self.deadlines.pop(key, None)
+
+    # Earliest live deadline, None when no timer is armed
+    def next_deadline(self) -> Optional[float]:
+        self.drop_stale()
+        return self.heap[0][0] if self.heap else None
+
+    # Take the timers that ran out by now, earliest first
+    def pop_expired(self, now: float) -> List[Hashable]:
+        expired = []
+        while True:
+            self.drop_stale()
+            if not self.heap or self.heap[0][0] > now:
+                return expired
+            _, _, key = heapq.heappop(self.heap)
+            del self.deadlines[key]
+            expired.append(key)
+
+    # Pop cancelled and re-armed entries off the top of the heap
+    def drop_stale(self) -> None:
+        heap = self.heap
+        while heap and self.deadlines.get(heap[0][2], (None, None))[1] != heap[0][1]:
+            heapq.heappop(heap)
+
+    # Rebuild the heap from the live timers only
+    def compact(self) -> None:
+        self.heap = [(deadline, armed, key) for key, (deadline, armed) in self.deadlines.items()]
+        heapq.heapify(self.heap)